@@ -21,4 +21,12 @@
 ##############################################################################
 
 from . import ovh_account
+from . import account_invoice
+from . import product
+from . import partner
+from . import ovh_sync_run
+from . import ovh_invoice_info
+from . import ovh_soapi
+from . import ovh_rest
+from . import ovh_import_job
 from . import wizard
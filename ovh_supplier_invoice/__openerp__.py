@@ -23,7 +23,7 @@
 
 {
     'name': 'OVH Supplier Invoice',
-    'version': '0.3',
+    'version': '0.4',
     'category': 'Accounting & Finance',
     'license': 'AGPL-3',
     'summary': 'Get OVH Invoice via the API',
@@ -33,6 +33,10 @@
     'external_dependencies': {'python': ['requests', 'SOAPpy']},
     'data': [
         'ovh_account_view.xml',
+        'account_invoice_view.xml',
+        'ovh_import_job_view.xml',
+        'ovh_sync_run_view.xml',
+        'ovh_cron.xml',
         'security/ir.model.access.csv',
         'security/ovh_security.xml',
         'wizard/ovh_invoice_get_view.xml',
@@ -0,0 +1,109 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp import models, fields, api
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of invoices processed by each run of the PDF sweeper
+PDF_SWEEP_BATCH_SIZE = 100
+# Number of download attempts before giving up on the PDF of an invoice
+PDF_MAX_ATTEMPTS = 3
+
+
+class AccountInvoice(models.Model):
+    _inherit = 'account.invoice'
+
+    ovh_account_id = fields.Many2one(
+        'ovh.account', string='OVH Account', readonly=True, copy=False,
+        ondelete='set null')
+    ovh_sync_run_id = fields.Many2one(
+        'ovh.sync.run', string='OVH Import Run', readonly=True, copy=False,
+        index=True, ondelete='set null')
+
+    # Set when the import of the OVH invoice didn't download its PDF:
+    # the PDF is downloaded later with the reference and the password
+    ovh_pdf_reference = fields.Char(
+        string='OVH Invoice Reference', readonly=True, copy=False)
+    ovh_pdf_password = fields.Char(
+        string='OVH Invoice PDF Password', readonly=True, copy=False)
+    ovh_pdf_pending = fields.Boolean(
+        string='OVH PDF to Download', readonly=True, copy=False,
+        index=True)
+    ovh_pdf_attempts = fields.Integer(
+        string='OVH PDF Download Attempts', readonly=True, copy=False)
+
+    def _auto_init(self, cr, context=None):
+        res = super(AccountInvoice, self)._auto_init(cr, context=context)
+        # Index used by the OVH wizard to detect the invoices
+        # that have already been imported
+        cr.execute(
+            "SELECT indexname FROM pg_indexes WHERE indexname = "
+            "'account_invoice_partner_type_supplier_invoice_number_index'")
+        if not cr.fetchone():
+            cr.execute(
+                "CREATE INDEX "
+                "account_invoice_partner_type_supplier_invoice_number_index "
+                "ON account_invoice "
+                "(partner_id, type, supplier_invoice_number)")
+        return res
+
+    @api.multi
+    def ovh_fetch_pdf(self):
+        """Downloads and attaches the PDF of the OVH invoices that were
+        imported without their PDF"""
+        invoices = self.sudo().filtered('ovh_pdf_pending')
+        pdf_todo = [
+            (invoice, {
+                'number': invoice.ovh_pdf_reference,
+                'date': invoice.date_invoice,
+                }, invoice.ovh_pdf_password)
+            for invoice in invoices]
+        wizard = self.env['ovh.invoice.get']
+        messages = {}
+        attached = wizard.ovh_invoices_attach_pdf(
+            pdf_todo, messages=messages)
+        wizard.flush_notes(messages)
+        attached.write({
+            'ovh_pdf_pending': False,
+            'ovh_pdf_password': False,
+            })
+        for invoice in invoices - attached:
+            invoice.ovh_pdf_attempts += 1
+        return True
+
+    @api.model
+    def _cron_fetch_ovh_pdf(self):
+        """Downloads the PDF of the OVH invoices that were imported
+        without their PDF, by batches"""
+        batch_size = self.env['ovh.invoice.get'].get_int_param(
+            'ovh_supplier_invoice.pdf_sweep_batch_size', PDF_SWEEP_BATCH_SIZE)
+        invoices = self.search([
+            ('ovh_pdf_pending', '=', True),
+            ('ovh_pdf_attempts', '<', PDF_MAX_ATTEMPTS),
+            ], limit=batch_size, order='id')
+        if invoices:
+            logger.info(
+                'Downloading the PDF of %d OVH invoices', len(invoices))
+            invoices.ovh_fetch_pdf()
+        return True
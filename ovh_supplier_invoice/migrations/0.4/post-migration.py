@@ -0,0 +1,47 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+RULES = [
+    'ovh_account_rule', 'ovh_invoice_import_job_rule', 'ovh_sync_run_rule',
+    'ovh_sync_run_account_rule']
+DOMAIN = (
+    "['|', ('company_id', '=', False), "
+    "('company_id', 'in', [c.id for c in user.company_ids])]")
+
+
+def migrate(cr, version):
+    """The multi-company rules of the module are in a noupdate block:
+    they now accept all the allowed companies of the user, so that one
+    import run covers the OVH accounts of all these companies"""
+    if not version:
+        return
+    cr.execute(
+        "UPDATE ir_rule SET domain_force = %s WHERE id IN ("
+        "SELECT res_id FROM ir_model_data WHERE module = %s "
+        "AND model = 'ir.rule' AND name IN %s)",
+        (DOMAIN, 'ovh_supplier_invoice', tuple(RULES)))
+    logger.info(
+        'Updated %d multi-company rules of the OVH models', cr.rowcount)
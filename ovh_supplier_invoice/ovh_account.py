@@ -22,6 +22,7 @@
 
 from openerp import models, fields, api, _
 from openerp.exceptions import ValidationError
+from .ovh_rest import REST_ENDPOINT
 
 
 class OvhAccount(models.Model):
@@ -34,6 +35,20 @@ class OvhAccount(models.Model):
         string='OVH Password',
         help="You can leave this field empty and enter the password "
         "at runtime.")
+    api_type = fields.Selection([
+        ('soapi', 'SoAPI'),
+        ('rest', 'REST API'),
+        ], string='OVH API', required=True, default='soapi',
+        help="The REST API lists only the OVH invoices after the last "
+        "import, but its invoice lines have no service code, so it "
+        "requires the method 'Without Product'.")
+    rest_endpoint = fields.Char(
+        string='REST API Endpoint', default=REST_ENDPOINT)
+    application_key = fields.Char(string='Application Key')
+    application_secret = fields.Char(string='Application Secret')
+    consumer_key = fields.Char(
+        string='Consumer Key',
+        help="Consumer key with the right GET on /me/bill/*")
     active = fields.Boolean(default=True)
     invoice_line_method = fields.Selection([
         ('product', 'With Product'),
@@ -51,16 +66,108 @@ class OvhAccount(models.Model):
     account_analytic_id = fields.Many2one(
         'account.analytic.account', string='Analytic Account',
         domain=[('type', '!=', 'view')])
+    group_invoice_lines = fields.Boolean(
+        string='Group Invoice Lines',
+        help="If set, the lines of the OVH invoices with the same product "
+        "(or expense account), analytic account, taxes and service period "
+        "are grouped in a single invoice line. Useful for the telephony "
+        "and SMS invoices, that can have thousands of lines.")
+    attach_detail_csv = fields.Boolean(
+        string='Attach Detailed Lines as CSV',
+        help="If set, the detailed lines of each OVH invoice are attached "
+        "to the supplier invoice as a CSV file.")
+    scheduled_import = fields.Boolean(
+        string='Scheduled Import',
+        help="If set, the OVH invoices of this account are imported "
+        "regularly by a scheduled action, with the stored password.")
+    import_user_id = fields.Many2one(
+        'res.users', string='Scheduled Import User',
+        help="User who runs the scheduled imports of this account: this "
+        "user is the responsible of the imported invoices and the author "
+        "of their notes. If empty, the scheduled imports are run by the "
+        "superuser.")
+    last_bill_date = fields.Date(
+        string='Last Imported Invoice Date', readonly=True,
+        help="Date of the most recent OVH invoice imported for this "
+        "account. The OVH invoices dated before this date (or dated this "
+        "day with a lower number) are ignored by the next imports, unless "
+        "the option 'Full Resync' is set in the wizard.")
+    last_bill_number = fields.Char(
+        string='Last Imported Invoice Number', readonly=True)
 
     _sql_constrains = [
         ('login_unique', 'unique(login)', 'This OVH NIC already exists'),
         ]
 
+    @api.multi
+    def is_bill_after_last_import(self, bill_date, bill_number):
+        self.ensure_one()
+        if not self.last_bill_date:
+            return True
+        return (bill_date, bill_number) > (
+            self.last_bill_date, self.last_bill_number or '')
+
+    @api.multi
+    def update_last_import(self, bill_date, bill_number):
+        self.ensure_one()
+        if self.is_bill_after_last_import(bill_date, bill_number):
+            # Accountants only have read access on ovh.account
+            self.sudo().write({
+                'last_bill_date': bill_date,
+                'last_bill_number': bill_number,
+                })
+
+    @api.model
+    def _cron_enqueue_import_jobs(self):
+        jobo = self.env['ovh.invoice.import.job']
+        accounts = self.search([
+            ('scheduled_import', '=', True),
+            '|', ('password', '!=', False), ('api_type', '=', 'rest'),
+            ])
+        for account in accounts:
+            # don't enqueue a 2nd job if the previous one is not finished
+            if jobo.search([
+                    ('ovh_account_id', '=', account.id),
+                    ('state', 'in', ('pending', 'running'))]):
+                continue
+            vals = {
+                'ovh_account_id': account.id,
+                'user_id': account.import_user_id.id or self._uid,
+                'attach_pdf': True,
+                }
+            if not account.last_bill_date:
+                # same default as the wizard for the first import
+                vals['from_date'] = fields.Date.to_string(
+                    self.env['ovh.invoice.get']._default_from_date())
+            jobo.create(vals)
+        return True
+
     @api.one
-    @api.constrains('invoice_line_method', 'account_id')
+    @api.constrains(
+        'invoice_line_method', 'account_id', 'api_type', 'rest_endpoint',
+        'application_key', 'application_secret', 'consumer_key',
+        'import_user_id', 'company_id')
     def _check_ovh_account(self):
         if self.invoice_line_method == 'no_product' and not self.account_id:
             raise ValidationError(_(
                 "Missing expense account on OVH account %s which "
                 "has a method 'Without Product'.")
                 % self.login)
+        if self.api_type == 'rest':
+            if self.invoice_line_method != 'no_product':
+                raise ValidationError(_(
+                    "The OVH account %s uses the REST API, so it must "
+                    "have the method 'Without Product'.") % self.login)
+            if not (
+                    self.rest_endpoint and self.application_key and
+                    self.application_secret and self.consumer_key):
+                raise ValidationError(_(
+                    "Missing endpoint or keys of the REST API on OVH "
+                    "account %s.") % self.login)
+        if (
+                self.import_user_id and
+                self.company_id not in self.import_user_id.company_ids):
+            raise ValidationError(_(
+                "The scheduled import user of OVH account %s is not "
+                "allowed in the company %s.")
+                % (self.login, self.company_id.name))
@@ -0,0 +1,282 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp import models, fields, api, _
+from openerp.exceptions import Warning
+from .wizard.ovh_invoice_get import exception_message, CREATE_CHUNK_SIZE
+from .ovh_sync_run import SyncStats
+from datetime import datetime, timedelta
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Minutes without progress after which a running job is considered as
+# interrupted (worker killed, server restarted...), which can be changed
+# with the config parameter ovh_supplier_invoice.job_timeout
+JOB_TIMEOUT = 15
+# Seconds of import per execution of the scheduled action, well below the
+# limit_time_real of the cron workers: the jobs that are not finished are
+# resumed by the next execution (ovh_supplier_invoice.job_time_budget)
+JOB_TIME_BUDGET = 120
+# Jobs started per execution of the scheduled action
+# (ovh_supplier_invoice.jobs_per_cron)
+JOBS_PER_CRON = 10
+# Interruptions after which a job is marked as failed instead of resumed
+JOB_MAX_ATTEMPTS = 3
+
+
+class OvhInvoiceImportJob(models.Model):
+    _name = 'ovh.invoice.import.job'
+    _description = 'OVH Invoice Import Job'
+    _order = 'id desc'
+    _rec_name = 'ovh_account_id'
+
+    ovh_account_id = fields.Many2one(
+        'ovh.account', string='OVH Account', required=True,
+        ondelete='cascade', readonly=True)
+    company_id = fields.Many2one(
+        related='ovh_account_id.company_id', store=True, readonly=True)
+    user_id = fields.Many2one(
+        'res.users', string='User', required=True, readonly=True,
+        default=lambda self: self.env.user)
+    # Password entered in the wizard, deleted when the job is finished.
+    # Only the scheduled action (superuser) reads it.
+    password = fields.Char(string='OVH Password', groups='base.group_system')
+    from_date = fields.Date(string='From Date', readonly=True)
+    full_resync = fields.Boolean(string='Full Resync', readonly=True)
+    attach_pdf = fields.Boolean(
+        string='Attach PDF of OVH Invoice', readonly=True)
+    defer_pdf = fields.Boolean(string='Download PDF Later', readonly=True)
+    auto_validate = fields.Boolean(string='Auto Validate', readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('cancel', 'Cancelled'),
+        ], string='State', default='pending', readonly=True, index=True)
+    phase = fields.Selection([
+        ('login', 'Login'),
+        ('list', 'List of Invoices'),
+        ('import', 'Import of Invoices'),
+        ('pdf', 'Download of PDF'),
+        ], string='Phase', readonly=True)
+    todo_count = fields.Integer(
+        string='Invoices to Import', readonly=True)
+    done_count = fields.Integer(
+        string='Invoices Processed', readonly=True)
+    date_start = fields.Datetime(string='Start Date', readonly=True)
+    date_end = fields.Datetime(string='End Date', readonly=True)
+    invoice_ids = fields.One2many(
+        related='sync_run_id.invoice_ids', string='Imported Invoices',
+        readonly=True)
+    error = fields.Text(string='Errors', readonly=True)
+    attempts = fields.Integer(
+        string='Interruptions', readonly=True,
+        help="Number of times the job was interrupted (worker killed, "
+        "server restarted...) and resumed.")
+    sync_run_id = fields.Many2one(
+        'ovh.sync.run', string='Import Run', readonly=True)
+
+    @api.multi
+    def update_progress(self, phase, todo=None, done=None):
+        self.ensure_one()
+        vals = {'phase': phase}
+        if todo is not None:
+            vals['todo_count'] = todo
+        if done is not None:
+            vals['done_count'] = done
+        self.write(vals)
+
+    @api.multi
+    def run(self, deadline=None):
+        """Runs the import jobs. Commits the transaction after each chunk
+        of invoices, so it must only be called by the scheduled action.
+        When deadline (a time.time() value) is reached, the current job is
+        put back to pending: the next execution resumes it with the same
+        import run, skipping the invoices already created"""
+        for job in self:
+            if deadline and time.time() > deadline:
+                break
+            date_start = fields.Datetime.now()
+            run = job.sync_run_id
+            if not run:
+                # the run is committed before the import, as the imported
+                # invoices are linked to it
+                run = self.env['ovh.sync.run'].create({
+                    'mode': 'job',
+                    'user_id': job.user_id.id,
+                    'company_id': job.company_id.id,
+                    'date_start': date_start,
+                    })
+            job.write({
+                'state': 'running',
+                'phase': 'login',
+                'date_start': job.date_start or date_start,
+                'sync_run_id': run.id,
+                })
+            self._cr.commit()
+            start = time.time()
+            stats = SyncStats()
+            ovh_account = job.ovh_account_id.sudo(job.user_id)
+            wizard = self.env['ovh.invoice.get'].sudo(job.user_id)
+            password = job.password or ovh_account.password
+            options = {
+                'from_date': job.from_date,
+                'full_resync': job.full_resync,
+                'attach_pdf': job.attach_pdf,
+                'defer_pdf': job.defer_pdf,
+                'auto_validate': job.auto_validate,
+                # commit regularly to publish the progress of the job
+                'commit_every': wizard.get_int_param(
+                    'ovh_supplier_invoice.create_chunk_size',
+                    CREATE_CHUNK_SIZE),
+                'progress': job.update_progress,
+                'stats': stats,
+                'sync_run_id': run.id,
+                'deadline': deadline,
+                }
+            try:
+                if ovh_account.api_type == 'soapi' and not password:
+                    raise Warning(_(
+                        "Missing password on OVH account '%s'.")
+                        % ovh_account.login)
+                # the SOAP proxy is only built for the SoAPI accounts
+                created, errors = wizard.import_ovh_account(
+                    None, ovh_account, password,
+                    wizard.get_country_code(ovh_account.company_id),
+                    wizard.get_ovh_partner(),
+                    wizard.get_ovh_products(), options)
+            except Exception, e:
+                self._cr.rollback()
+                self.env.invalidate_all()
+                logger.exception(
+                    'OVH import job %d on account %s failed',
+                    job.id, job.ovh_account_id.login)
+                options.pop('interrupted', None)
+                errors = [exception_message(e)]
+            run.add_account_stats(
+                job.ovh_account_id, stats, time.time() - start,
+                error='\n'.join(errors))
+            # the errors of the previous executions of a resumed job
+            errors = filter(None, [job.error] + errors)
+            if options.get('interrupted'):
+                job.write({
+                    'state': 'pending',
+                    'error': '\n'.join(errors) or False,
+                    })
+                self._cr.commit()
+                continue
+            run.close()
+            job.write({
+                'state': errors and 'failed' or 'done',
+                'error': '\n'.join(errors) or False,
+                'date_end': fields.Datetime.now(),
+                'password': False,
+                })
+            self._cr.commit()
+        return True
+
+    @api.model
+    def _get_stale_date(self):
+        """The running jobs write their progress after each chunk of
+        invoices, so a running job that has not been written since this
+        date is not running any more"""
+        timeout = self.env['ovh.invoice.get'].get_int_param(
+            'ovh_supplier_invoice.job_timeout', JOB_TIMEOUT)
+        return fields.Datetime.to_string(
+            datetime.now() - timedelta(minutes=timeout))
+
+    @api.multi
+    def requeue(self):
+        stale_date = self._get_stale_date()
+        for job in self:
+            if job.state == 'running' and job.write_date > stale_date:
+                raise Warning(_(
+                    "The import job of OVH account '%s' is still running.")
+                    % job.ovh_account_id.login)
+            # the password entered in the wizard is deleted when the job
+            # ends, and the password of the account is optional
+            ovh_account = job.ovh_account_id.sudo()
+            if (
+                    ovh_account.api_type == 'soapi' and
+                    not job.sudo().password and not ovh_account.password):
+                raise Warning(_(
+                    "The password of OVH account '%s' entered in the "
+                    "wizard has been deleted at the end of the import job. "
+                    "Start a new import from the wizard instead.")
+                    % ovh_account.login)
+        self.write({
+            'state': 'pending',
+            'phase': False,
+            'todo_count': 0,
+            'done_count': 0,
+            'error': False,
+            'attempts': 0,
+            # a new import run is started
+            'sync_run_id': False,
+            'date_start': False,
+            'date_end': False,
+            })
+
+    @api.multi
+    def cancel(self):
+        self.write({'state': 'cancel'})
+        self.sudo().write({'password': False})
+
+    @api.model
+    def _cron_run_jobs(self):
+        stale_jobs = self.search([
+            ('state', '=', 'running'),
+            ('write_date', '<', self._get_stale_date()),
+            ])
+        if stale_jobs:
+            logger.warning(
+                'OVH import jobs %s were interrupted', stale_jobs.ids)
+        for job in stale_jobs:
+            # the invoices committed before the interruption are skipped
+            # when the job is resumed
+            if job.attempts + 1 < JOB_MAX_ATTEMPTS:
+                job.write({'state': 'pending', 'attempts': job.attempts + 1})
+                continue
+            # the next scheduled import of the account can start
+            job.write({
+                'state': 'failed',
+                'attempts': job.attempts + 1,
+                'error': _('The job was interrupted %d times.')
+                % (job.attempts + 1),
+                'date_end': fields.Datetime.now(),
+                'password': False,
+                })
+            job.sync_run_id.close()
+        self._cr.commit()
+        wizard = self.env['ovh.invoice.get']
+        deadline = time.time() + wizard.get_int_param(
+            'ovh_supplier_invoice.job_time_budget', JOB_TIME_BUDGET)
+        jobs = self.search(
+            [('state', '=', 'pending')], order='id',
+            limit=wizard.get_int_param(
+                'ovh_supplier_invoice.jobs_per_cron', JOBS_PER_CRON))
+        logger.info('Running %d OVH import jobs', len(jobs))
+        jobs.run(deadline=deadline)
+        return True
@@ -0,0 +1,133 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp import models, fields, api
+from UserList import UserList
+import openerp
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+
+class OvhBill(dict):
+    """Plain python version of the result of the SoAPI query
+    billingInvoiceInfo, with access to the keys as attributes like
+    on the SOAPpy objects"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @classmethod
+    def from_python(cls, value):
+        if isinstance(value, dict):
+            return cls([(k, cls.from_python(v)) for k, v in value.items()])
+        elif isinstance(value, list):
+            return [cls.from_python(v) for v in value]
+        return value
+
+    @classmethod
+    def from_soap(cls, value):
+        if hasattr(value, '_asdict'):  # SOAPpy structType
+            res = cls([
+                (k, cls.from_soap(v)) for k, v in value._asdict().items()])
+            # billingInvoiceInfo returns a struct instead of a list
+            # when the invoice has only 1 line
+            if 'details' in res and not isinstance(
+                    res['details'].get('item'), list):
+                res['details']['item'] = [res['details']['item']]
+            return res
+        elif isinstance(value, (list, tuple, UserList)):
+            return [cls.from_soap(v) for v in value]
+        elif value is None or isinstance(
+                value, (bool, int, long, float, basestring)):
+            return value
+        return unicode(value)
+
+
+class OvhInvoiceInfo(models.Model):
+    """Cache of the details of the OVH invoices (result of the SoAPI
+    query billingInvoiceInfo or normalized bill of the REST API): the
+    OVH invoices never change once they are issued, so the details are
+    only downloaded once"""
+    _name = 'ovh.invoice.info'
+    _description = 'Cache of OVH Invoice Details'
+    _rec_name = 'number'
+
+    login = fields.Char(string='OVH NIC', required=True, index=True)
+    number = fields.Char(string='OVH Invoice Number', required=True)
+    # the details of the 2 APIs are not the same (no service code on
+    # the lines of the REST API)
+    api_type = fields.Selection([
+        ('soapi', 'SoAPI'),
+        ('rest', 'REST API'),
+        ], string='OVH API', required=True, default='soapi')
+    date = fields.Date(string='Date')
+    payload = fields.Text(string='Details', required=True)
+
+    _sql_constraints = [(
+        'login_number_unique', 'unique(login, api_type, number)',
+        'This OVH invoice is already in the cache.')]
+
+    @api.model
+    def get_bills(self, login, numbers, api_type='soapi'):
+        """Returns a dict {number: OvhBill} of the cached details"""
+        res = {}
+        if not numbers:
+            return res
+        for info in self.search_read([
+                ('login', '=', login),
+                ('api_type', '=', api_type),
+                ('number', 'in', numbers),
+                ], ['number', 'payload']):
+            res[info['number']] = OvhBill.from_python(
+                json.loads(info['payload']))
+        return res
+
+    @api.model
+    def store_bills(self, login, bills, api_type='soapi'):
+        """bills is a list of (invoice_desc, OvhBill). They are stored with
+        a separate cursor, so that they are kept even if the import fails
+        afterwards"""
+        if not bills:
+            return
+        registry = openerp.registry(self._cr.dbname)
+        with registry.cursor() as cr:
+            env = api.Environment(cr, self._uid, self._context)
+            for invoice_desc, bill in bills:
+                try:
+                    with cr.savepoint():
+                        env[self._name].create({
+                            'login': login,
+                            'api_type': api_type,
+                            'number': invoice_desc['number'],
+                            'date': invoice_desc['date'],
+                            'payload': json.dumps(bill),
+                            })
+                except Exception, e:
+                    # the invoice may have been stored by a concurrent import
+                    logger.warning(
+                        'Could not store the details of OVH invoice %s '
+                        'in the cache: %s', invoice_desc['number'], e)
@@ -0,0 +1,201 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from .ovh_invoice_info import OvhBill
+from .ovh_soapi import rate_limiter
+from multiprocessing.pool import ThreadPool
+from datetime import datetime, timedelta
+import requests
+import threading
+import hashlib
+import logging
+import urllib
+import time
+
+logger = logging.getLogger(__name__)
+
+REST_ENDPOINT = 'https://eu.api.ovh.com/1.0'
+
+# Clients of the OVH REST API of this process, to reuse their connections
+# key = (endpoint, application key, consumer key, hash of the secret)
+rest_clients = {}
+rest_clients_lock = threading.Lock()
+
+
+class OvhRestError(Exception):
+    pass
+
+
+def normalize_bill(header, details):
+    """Returns an OvhBill with the same structure as the result of the
+    SoAPI query billingInvoiceInfo, built from a bill of the REST API
+    (/me/bill/{billId}) and its details, so that the invoices are
+    prepared by the same code for both APIs"""
+    baseprice = header['priceWithoutTax']['value']
+    tax = header['tax']['value']
+    items = []
+    for detail in details:
+        end = detail.get('periodEnd')
+        if end:
+            # the SoAPI gives the day after the end of the period
+            end = (
+                datetime.strptime(end[:10], '%Y-%m-%d') + timedelta(days=1)
+                ).strftime('%Y-%m-%d')
+        items.append({
+            'service': False,
+            'domain': detail.get('domain'),
+            'description': detail.get('description'),
+            'start': detail.get('periodStart'),
+            'end': end,
+            'quantity': detail.get('quantity'),
+            'baseprice': detail['unitPrice']['value'],
+            'totalprice': detail['totalPrice']['value'],
+            })
+    return OvhBill.from_python({
+        'billnum': header['billId'],
+        'date': header['date'][:10],
+        'baseprice': baseprice,
+        'tax': tax,
+        'finalprice': header['priceWithTax']['value'],
+        # the REST API doesn't give the tax rate, and the rate derived
+        # from the rounded amounts is not exact (0.202 for a bill of 0.99),
+        # so it is matched with the purchase taxes when the invoice is
+        # prepared
+        'taxrate': baseprice and tax / baseprice or 0.0,
+        'taxrate_derived': True,
+        'password': header.get('password'),
+        'pdf_url': header.get('pdfUrl'),
+        'details': {'item': items},
+        })
+
+
+class OvhRestClient(object):
+    """Client of the bills of the OVH REST API, authenticated with the
+    keys of an OVH application. It is kept in the pool of the process and
+    the requests of the worker threads share the connections of its HTTP
+    session."""
+
+    def __init__(
+            self, application_key, application_secret, consumer_key,
+            endpoint=REST_ENDPOINT, workers=4):
+        self.application_key = application_key
+        self.application_secret = application_secret
+        self.consumer_key = consumer_key
+        self.endpoint = endpoint.rstrip('/')
+        self.workers = workers
+        self.http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=workers)
+        self.http_session.mount('https://', adapter)
+        self.http_session.mount('http://', adapter)
+        self.time_delta = None
+        self.lock = threading.Lock()
+
+    def get_time_delta(self):
+        """Difference between the clock of OVH and the local clock, used
+        to sign the requests"""
+        with self.lock:
+            if self.time_delta is None:
+                res = rate_limiter.call(
+                    self.http_session.get, self.endpoint + '/auth/time',
+                    timeout=60)
+                res.raise_for_status()
+                self.time_delta = int(res.text) - int(time.time())
+            return self.time_delta
+
+    def get(self, path, params=None):
+        url = self.endpoint + path
+        if params:
+            url += '?' + urllib.urlencode(sorted(params.items()))
+        timestamp = str(int(time.time()) + self.get_time_delta())
+        signature = hashlib.sha1('+'.join([
+            self.application_secret, self.consumer_key, 'GET', url, '',
+            timestamp]).encode('utf-8')).hexdigest()
+        res = rate_limiter.call(
+            self.http_session.get, url, timeout=60, headers={
+                'X-Ovh-Application': self.application_key,
+                'X-Ovh-Consumer': self.consumer_key,
+                'X-Ovh-Timestamp': timestamp,
+                'X-Ovh-Signature': '$1$' + signature,
+                })
+        if res.status_code != 200:
+            try:
+                message = res.json().get('message')
+            except ValueError:
+                message = res.text
+            raise OvhRestError('GET %s: HTTP error %d (%s)' % (
+                path, res.status_code, message))
+        return res.json()
+
+    def list_bill_ids(self, date_from=None):
+        """Returns the IDs of the bills dated date_from or after"""
+        params = {}
+        if date_from:
+            params['date.from'] = date_from
+        return self.get('/me/bill', params)
+
+    def get_bill_headers(self, bill_ids):
+        """Returns [(bill ID, bill (/me/bill/{billId}), exception)] for
+        bill_ids, in the same order, where either the bill or the exception
+        is None. They are queried in parallel, and the failure of one bill
+        doesn't stop the others"""
+        if not bill_ids:
+            return []
+
+        def get_header(bill_id):
+            try:
+                return (bill_id, self.get('/me/bill/%s' % bill_id), None)
+            except Exception, e:
+                logger.warning('Could not query OVH bill %s: %s', bill_id, e)
+                return (bill_id, None, e)
+
+        pool = ThreadPool(min(self.workers, len(bill_ids)))
+        try:
+            return pool.map(get_header, bill_ids)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_bill(self, bill_id, header=None):
+        """Returns the bill and its details as an OvhBill, see
+        normalize_bill(). header is the bill if it has already been
+        queried by list_bills()"""
+        if header is None:
+            header = self.get('/me/bill/%s' % bill_id)
+        details = [
+            self.get('/me/bill/%s/details/%s' % (bill_id, detail_id))
+            for detail_id in self.get('/me/bill/%s/details' % bill_id)]
+        return normalize_bill(header, details)
+
+
+def get_rest_client(
+        application_key, application_secret, consumer_key, endpoint,
+        workers):
+    key = (
+        endpoint, application_key, consumer_key,
+        hashlib.sha1((application_secret or '').encode('utf-8')).hexdigest())
+    with rest_clients_lock:
+        if key not in rest_clients:
+            rest_clients[key] = OvhRestClient(
+                application_key, application_secret, consumer_key,
+                endpoint=endpoint, workers=workers)
+        return rest_clients[key]
@@ -0,0 +1,226 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from SOAPpy.Types import faultType
+from SOAPpy.Errors import HTTPError as SOAPHTTPError
+import requests
+import threading
+import httplib
+import hashlib
+import logging
+import random
+import socket
+import atexit
+import time
+
+logger = logging.getLogger(__name__)
+
+# HTTP codes on which a request to OVH is retried
+RETRY_HTTP_CODES = (429, 500, 502, 503, 504)
+
+
+class RateLimiter(object):
+    """Token bucket shared by all the requests of the process to OVH
+    (SoAPI and PDF files): at most `rate` requests per second, with
+    bursts of `burst` requests. Failed requests are retried with an
+    exponential backoff and a random jitter."""
+
+    def __init__(self, rate=10, burst=10, max_retries=5, base_delay=1.0,
+                 max_delay=60.0):
+        self.lock = threading.Lock()
+        self.configure(rate, burst, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.tokens = float(self.burst)
+        self.last = time.time()
+
+    def configure(self, rate, burst=None, max_retries=None):
+        with self.lock:
+            self.rate = float(max(rate, 1))
+            self.burst = max(burst or rate, 1)
+            if max_retries is not None:
+                self.max_retries = max(max_retries, 0)
+
+    def acquire(self):
+        """Waits until a request can be sent"""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(
+                    self.burst,
+                    self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, attempt):
+        """Full jitter: random delay between 0 and the exponential
+        backoff"""
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        """Calls func when the rate allows it and retries it on network
+        errors and on HTTP errors 429 and 5xx"""
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                res = func(*args, **kwargs)
+            except Exception, e:
+                if attempt >= self.max_retries or not is_transient_error(e):
+                    raise
+                delay = self.backoff(attempt)
+                reason = e
+            else:
+                if (
+                        not isinstance(res, requests.Response) or
+                        res.status_code not in RETRY_HTTP_CODES or
+                        attempt >= self.max_retries):
+                    return res
+                res.close()
+                delay = self.backoff(attempt)
+                retry_after = res.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    delay = min(float(retry_after), self.max_delay)
+                reason = 'HTTP error %d' % res.status_code
+            logger.warning(
+                'Request to OVH failed (%s), retry %d/%d in %.1f seconds',
+                reason, attempt + 1, self.max_retries, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+def is_transient_error(e):
+    if isinstance(e, SOAPHTTPError):
+        return e.code in RETRY_HTTP_CODES
+    return isinstance(e, (
+        socket.error, httplib.HTTPException,
+        requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+rate_limiter = RateLimiter()
+
+# Sessions of the OVH SoAPI opened by this process
+# key = (login, country_code, hash of the password)
+soap_sessions = {}
+soap_sessions_lock = threading.Lock()
+
+
+class OvhSoapSession(object):
+    """Session of the OVH SoAPI for an OVH account. It is kept in the pool
+    of the process and reused by the next imports until it expires.
+    If the SoAPI rejects a reused session, a new session is opened
+    transparently."""
+
+    def __init__(self, login, password, country_code, ttl):
+        self.login = login
+        self.password = password
+        self.country_code = country_code
+        self.ttl = ttl  # in seconds
+        self.session = None
+        self.expiry = 0
+        self.soap = None
+        self.lock = threading.Lock()
+
+    def _open(self, soap):
+        logger.info(
+            'Opening SOAP session to OVH (account %s, country %s)',
+            self.login, self.country_code)
+        self.session = rate_limiter.call(
+            soap.login, self.login, self.password, self.country_code, 0)
+        self.soap = soap
+        self.expiry = time.time() + self.ttl
+
+    def get(self, soap):
+        """Returns (session, True if the session has just been opened)"""
+        with self.lock:
+            if self.session and time.time() < self.expiry:
+                return self.session, False
+            self._logout()
+            self._open(soap)
+            return self.session, True
+
+    def invalidate(self, session):
+        with self.lock:
+            # another thread may have already opened a new session
+            if self.session == session:
+                self.session = None
+
+    def call(self, soap, method, *args):
+        """Calls the method of the SoAPI with the session as first
+        argument"""
+        session, new = self.get(soap)
+        try:
+            res = rate_limiter.call(getattr(soap, method), session, *args)
+        except faultType, e:
+            if new:
+                raise
+            logger.info(
+                'SoAPI fault with the session of OVH account %s (%s), '
+                'opening a new session', self.login, e)
+            self.invalidate(session)
+            session, new = self.get(soap)
+            res = rate_limiter.call(getattr(soap, method), session, *args)
+        with self.lock:
+            if self.session == session:
+                self.expiry = time.time() + self.ttl
+        return res
+
+    def _logout(self):
+        if self.session and self.soap:
+            try:
+                self.soap.logout(self.session)
+                logger.info(
+                    'SOAP session of OVH account %s closed', self.login)
+            except Exception, e:
+                logger.debug(
+                    'Failed to logout OVH account %s: %s', self.login, e)
+        self.session = None
+
+    def logout(self):
+        with self.lock:
+            self._logout()
+
+
+def get_soap_session(login, password, country_code, ttl):
+    key = (
+        login, country_code,
+        hashlib.sha1((password or '').encode('utf-8')).hexdigest())
+    with soap_sessions_lock:
+        if key not in soap_sessions:
+            soap_sessions[key] = OvhSoapSession(
+                login, password, country_code, ttl)
+        soap_sessions[key].ttl = ttl
+        return soap_sessions[key]
+
+
+@atexit.register
+def close_soap_sessions():
+    with soap_sessions_lock:
+        sessions = soap_sessions.values()
+        soap_sessions.clear()
+    for soap_session in sessions:
+        soap_session.logout()
@@ -0,0 +1,217 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp import models, fields, api
+from contextlib import contextmanager
+import threading
+import time
+
+
+class SyncStats(object):
+    """Counters and cumulative wall time of the phases of the import of
+    an OVH account. The phase 'detail' is timed in the worker threads,
+    so the methods are protected by a lock."""
+
+    counters = [
+        'listed', 'skipped_mark', 'skipped_old', 'skipped_zero',
+        'skipped_prepaid', 'skipped_duplicate', 'detail_cached',
+        'created', 'failed',
+        'validated', 'pdf_downloaded', 'pdf_reused']
+    phases = [
+        'login', 'list', 'detail', 'prepare', 'create', 'tax', 'pdf',
+        'validate']
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = dict.fromkeys(self.counters, 0)
+        self.timings = dict.fromkeys(self.phases, 0.0)
+
+    def incr(self, counter, value=1):
+        with self.lock:
+            self.values[counter] += value
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.timings[phase] += time.time() - start
+
+    def get_vals(self):
+        """Returns the values for the creation of an ovh.sync.run.account"""
+        vals = {}
+        for counter in self.counters:
+            vals['%s_count' % counter] = self.values[counter]
+        for phase in self.phases:
+            vals['%s_time' % phase] = self.timings[phase]
+        return vals
+
+
+class OvhSyncRun(models.Model):
+    _name = 'ovh.sync.run'
+    _description = 'OVH Invoice Import Run'
+    _order = 'date_start desc, id desc'
+    _rec_name = 'date_start'
+
+    date_start = fields.Datetime(
+        string='Start Date', required=True, readonly=True,
+        default=fields.Datetime.now)
+    date_end = fields.Datetime(string='End Date', readonly=True)
+    duration = fields.Float(
+        string='Duration (s)', readonly=True,
+        help="Wall time of the whole run, in seconds")
+    user_id = fields.Many2one(
+        'res.users', string='User', required=True, readonly=True,
+        default=lambda self: self.env.user)
+    company_id = fields.Many2one(
+        'res.company', string='Company', readonly=True,
+        default=lambda self: self.env.user.company_id)
+    mode = fields.Selection([
+        ('wizard', 'Wizard'),
+        ('parallel', 'Wizard with Parallel Accounts'),
+        ('job', 'Background Job'),
+        ], string='Mode', readonly=True, default='wizard')
+    line_ids = fields.One2many(
+        'ovh.sync.run.account', 'run_id', string='OVH Accounts',
+        readonly=True)
+    invoice_ids = fields.One2many(
+        'account.invoice', 'ovh_sync_run_id', string='Imported Invoices',
+        readonly=True)
+    listed_count = fields.Integer(
+        compute='_compute_totals', string='Listed', store=True)
+    created_count = fields.Integer(
+        compute='_compute_totals', string='Created', store=True)
+    failed_count = fields.Integer(
+        compute='_compute_totals', string='Failed', store=True)
+
+    @api.one
+    @api.depends(
+        'line_ids.listed_count', 'line_ids.created_count',
+        'line_ids.failed_count')
+    def _compute_totals(self):
+        self.listed_count = sum([l.listed_count for l in self.line_ids])
+        self.created_count = sum([l.created_count for l in self.line_ids])
+        self.failed_count = sum([l.failed_count for l in self.line_ids])
+
+    @api.multi
+    def add_account_stats(self, ovh_account, stats, duration, error=False):
+        self.ensure_one()
+        vals = stats.get_vals()
+        vals.update({
+            'run_id': self.id,
+            'ovh_account_id': ovh_account.id,
+            'duration': duration,
+            'error': error or False,
+            })
+        return self.env['ovh.sync.run.account'].create(vals)
+
+    @api.multi
+    def invoices_action(self):
+        action = self.env['ir.actions.act_window'].for_xml_id(
+            'account', 'action_invoice_tree2')
+        action.update({
+            'view_mode': 'tree,form,calendar,graph',
+            'domain': [('ovh_sync_run_id', 'in', self.ids)],
+            'views': False,
+            'nodestroy': False,
+            })
+        return action
+
+    @api.multi
+    def close(self):
+        for run in self:
+            date_end = fields.Datetime.now()
+            start_dt = fields.Datetime.from_string(run.date_start)
+            end_dt = fields.Datetime.from_string(date_end)
+            run.write({
+                'date_end': date_end,
+                'duration': (end_dt - start_dt).total_seconds(),
+                })
+
+
+class OvhSyncRunAccount(models.Model):
+    _name = 'ovh.sync.run.account'
+    _description = 'OVH Invoice Import Run for an OVH Account'
+    _order = 'run_id desc, id'
+    _rec_name = 'ovh_account_id'
+
+    run_id = fields.Many2one(
+        'ovh.sync.run', string='Run', required=True, ondelete='cascade',
+        readonly=True)
+    date_start = fields.Datetime(
+        related='run_id.date_start', store=True, readonly=True)
+    ovh_account_id = fields.Many2one(
+        'ovh.account', string='OVH Account', required=True,
+        ondelete='cascade', readonly=True)
+    company_id = fields.Many2one(
+        related='ovh_account_id.company_id', store=True, readonly=True)
+    duration = fields.Float(string='Duration (s)', readonly=True)
+    throughput = fields.Float(
+        compute='_compute_throughput', string='Invoices per Second',
+        store=True)
+    error = fields.Text(string='Errors', readonly=True)
+    listed_count = fields.Integer(string='Listed', readonly=True)
+    skipped_mark_count = fields.Integer(
+        string='Skipped (before last import)', readonly=True)
+    skipped_old_count = fields.Integer(
+        string='Skipped (too old)', readonly=True)
+    skipped_zero_count = fields.Integer(
+        string='Skipped (amount 0)', readonly=True)
+    skipped_prepaid_count = fields.Integer(
+        string='Skipped (pre-paid)', readonly=True)
+    skipped_duplicate_count = fields.Integer(
+        string='Skipped (already in Odoo)', readonly=True)
+    detail_cached_count = fields.Integer(
+        string='Details from Cache', readonly=True,
+        help="Number of OVH invoices whose details have been read from "
+        "the local cache instead of the SoAPI")
+    created_count = fields.Integer(string='Created', readonly=True)
+    failed_count = fields.Integer(string='Failed', readonly=True)
+    validated_count = fields.Integer(string='Validated', readonly=True)
+    pdf_downloaded_count = fields.Integer(
+        string='PDF Downloaded', readonly=True)
+    pdf_reused_count = fields.Integer(
+        string='PDF Already Stored', readonly=True,
+        help="Number of PDF files that were not downloaded because they "
+        "were already in the filestore")
+    login_time = fields.Float(string='Login (s)', readonly=True)
+    list_time = fields.Float(string='List (s)', readonly=True)
+    detail_time = fields.Float(
+        string='Details (s)', readonly=True,
+        help="Cumulative time of the billingInvoiceInfo queries. As they "
+        "are sent in parallel, it can be greater than the duration.")
+    prepare_time = fields.Float(
+        string='Preparation of Values (s)', readonly=True)
+    create_time = fields.Float(string='Creation (s)', readonly=True)
+    tax_time = fields.Float(string='Tax Computation (s)', readonly=True)
+    pdf_time = fields.Float(string='PDF (s)', readonly=True)
+    validate_time = fields.Float(string='Validation (s)', readonly=True)
+
+    @api.one
+    @api.depends('created_count', 'duration')
+    def _compute_throughput(self):
+        if self.duration:
+            self.throughput = self.created_count / self.duration
+        else:
+            self.throughput = 0.0
@@ -0,0 +1,76 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp import models, api, tools
+import re
+
+OVH_VAT = 'FR22424761419'
+
+
+def is_ovh_vat(vat):
+    """Returns True if vat is the VAT number of OVH, whatever its
+    formatting (spaces, dots, lower case)"""
+    return bool(vat) and re.sub(
+        r'[^A-Za-z0-9]', '', vat).upper() == OVH_VAT
+
+
+class ResPartner(models.Model):
+    _inherit = 'res.partner'
+
+    @tools.ormcache(skiparg=2)
+    def _get_ovh_partner_id(self, cr, uid):
+        """Returns the ID of the supplier OVH (VAT number FR22424761419),
+        or False. It is kept in the cache of the registry until a partner
+        with the VAT number of OVH is modified."""
+        partner_ids = self.search(cr, uid, [
+            ('sanitized_vat', '=', OVH_VAT),
+            ('parent_id', '=', False),
+            ('supplier', '=', True),
+            ], limit=1)
+        return partner_ids and partner_ids[0] or False
+
+    @api.multi
+    def _has_ovh_vat(self):
+        return any([is_ovh_vat(partner.vat) for partner in self])
+
+    @api.model
+    def create(self, vals):
+        # clear_caches() invalidates the caches of all the workers, so
+        # it is only called when the supplier OVH may change
+        if is_ovh_vat(vals.get('vat')):
+            self.clear_caches()
+        return super(ResPartner, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        if any([
+                field in vals for field in
+                ('vat', 'supplier', 'parent_id', 'active')]) and (
+                    is_ovh_vat(vals.get('vat')) or self._has_ovh_vat()):
+            self.clear_caches()
+        return super(ResPartner, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        if self._has_ovh_vat():
+            self.clear_caches()
+        return super(ResPartner, self).unlink()
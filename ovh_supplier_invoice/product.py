@@ -0,0 +1,102 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp import models, api, tools
+
+
+class OvhServiceIndex(object):
+    """Longest prefix index of the OVH products on the service code
+    of the OVH invoice lines. It is a trie: the lookup of a service code
+    only depends on the length of the service code."""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, service, product_id):
+        node = self.root
+        for char in service:
+            node = node.setdefault(char, {})
+        # if 2 products have the same prefix, the first one wins
+        node.setdefault(None, product_id)
+
+    def match(self, service):
+        """Returns the ID of the product with the longest prefix
+        matching service, or False"""
+        node = self.root
+        product_id = node.get(None, False)
+        for char in service:
+            node = node.get(char)
+            if node is None:
+                break
+            product_id = node.get(None, product_id)
+        return product_id
+
+
+def is_ovh_code(default_code):
+    return bool(default_code) and default_code.startswith('OVH-')
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    @tools.ormcache(skiparg=2)
+    def _get_ovh_service_index(self, cr, uid):
+        """The OVH products have an Internal Reference 'OVH-<prefix>'
+        where prefix is the beginning of the service code of the OVH
+        invoice lines. The index is kept in the cache of the registry
+        until an Internal Reference of a product is modified."""
+        index = OvhServiceIndex()
+        product_ids = self.search(
+            cr, uid, [('default_code', '=like', 'OVH-%')])
+        for product in self.read(cr, uid, product_ids, ['default_code']):
+            index.add(product['default_code'][4:], product['id'])
+        return index
+
+    @api.multi
+    def _has_ovh_code(self):
+        """Returns True if one of the products is in the index of the
+        OVH products"""
+        return any([
+            is_ovh_code(product.default_code) for product in self])
+
+    @api.model
+    def create(self, vals):
+        # clear_caches() invalidates the caches of all the workers, so
+        # it is only called when the index of the OVH products changes
+        if is_ovh_code(vals.get('default_code')):
+            self.clear_caches()
+        return super(ProductProduct, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        if (
+                ('default_code' in vals or 'active' in vals) and (
+                    is_ovh_code(vals.get('default_code')) or
+                    self._has_ovh_code())):
+            self.clear_caches()
+        return super(ProductProduct, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        if self._has_ovh_code():
+            self.clear_caches()
+        return super(ProductProduct, self).unlink()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""Throughput benchmark of the import of the OVH invoices, against the
+stand-in of the OVH SoAPI (ovh_soapi_standin.py).
+
+For each method of invoice line ('product' and 'no_product') and each
+number of OVH invoices, an OVH account is imported in a transaction that
+is rolled back at the end, and the benchmark reports the invoices per
+second, the SQL queries per invoice and the growth of the peak memory of
+the process. The database must have the module ovh_supplier_invoice
+installed, the supplier OVH, a purchase tax of 20% and an expense account.
+
+Usage:
+
+    python ovh_soapi_standin.py --wsdl /tmp/ovh_standin.wsdl &
+    python ovh_benchmark.py -c /etc/odoo/openerp-server.conf -d db \\
+        --wsdl /tmp/ovh_standin.wsdl --save baseline.json
+    # after a change of the import:
+    python ovh_benchmark.py -c /etc/odoo/openerp-server.conf -d db \\
+        --wsdl /tmp/ovh_standin.wsdl --baseline baseline.json
+
+With --baseline, the exit code is 1 if a case is slower or runs more
+queries per invoice than the baseline, beyond the tolerance.
+"""
+
+import openerp
+from openerp import api, SUPERUSER_ID
+from ovh_soapi_standin import SERVICES, TAX_RATE
+import argparse
+import resource
+import json
+import time
+import sys
+import os
+
+METHODS = ['product', 'no_product']
+SIZES = [10, 1000, 10000]
+
+
+def sql_counter(cr):
+    """Number of queries executed by the cursor of the benchmark. The
+    queries of the other cursors (cache of the details of the OVH
+    invoices) are not counted"""
+    if not hasattr(cr, 'sql_log_count'):
+        sys.exit('The cursors of this version of Odoo do not count queries')
+    return cr.sql_log_count
+
+
+def peak_memory():
+    """Peak memory of the process, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def prepare_benchmark(env, args, method, bills):
+    """Configures the database (in the transaction of the benchmark) and
+    returns the OVH account to import"""
+    icpo = env['ir.config_parameter']
+    icpo.set_param('ovh_supplier_invoice.wsdl_path', args.wsdl)
+    icpo.set_param('ovh_supplier_invoice.pdf_url', args.pdf_url)
+    # the stand-in is not limited like the SoAPI
+    icpo.set_param('ovh_supplier_invoice.max_requests_per_second', '10000')
+    company = env.user.company_id
+    tax = env['account.tax'].search([
+        ('type_tax_use', '=', 'purchase'),
+        ('amount', '=', TAX_RATE),
+        ('type', '=', 'percent'),
+        ('price_include', '=', False),
+        ('company_id', '=', company.id),
+        ], limit=1)
+    if not tax:
+        sys.exit('Missing purchase tax of %d%%' % (TAX_RATE * 100))
+    if method == 'product':
+        index = env['ovh.invoice.get'].get_ovh_products()
+        for service in SERVICES:
+            if not index.match(service):
+                env['product.product'].create({
+                    'name': 'OVH %s' % service,
+                    'default_code': 'OVH-%s' % service,
+                    'type': 'service',
+                    'purchase_ok': True,
+                    'supplier_taxes_id': [(6, 0, [tax.id])],
+                    })
+    account = env['account.account'].search([
+        ('type', '=', 'other'),
+        ('user_type.code', '=', 'expense'),
+        ('company_id', '=', company.id),
+        ], limit=1)
+    if not account:
+        sys.exit('Missing expense account')
+    return env['ovh.account'].create({
+        'login': 'bench-%s-%dx%d' % (method, bills, args.lines),
+        'password': 'bench',
+        'invoice_line_method': method,
+        'account_id': account.id,
+        'company_id': company.id,
+        })
+
+
+def run_case(registry, args, method, bills):
+    # the addons can only be imported once the registry is loaded
+    from openerp.addons.ovh_supplier_invoice.ovh_sync_run import SyncStats
+    stats = SyncStats()
+    options = {
+        'from_date': False,
+        'full_resync': True,
+        'attach_pdf': args.attach_pdf,
+        'defer_pdf': False,
+        'auto_validate': args.auto_validate,
+        'commit_every': 0,
+        'stats': stats,
+        }
+    with api.Environment.manage():
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            ovh_account = prepare_benchmark(env, args, method, bills)
+            login = ovh_account.login
+            wizard = env['ovh.invoice.get']
+            soap = wizard.get_soap_proxy()
+            country_code = wizard.get_country_code()
+            ovh_partner = wizard.get_ovh_partner()
+            products = wizard.get_ovh_products()
+            memory_start = peak_memory()
+            queries_start = sql_counter(cr)
+            start = time.time()
+            created, errors = wizard.import_ovh_account(
+                soap, ovh_account, 'bench', country_code, ovh_partner,
+                products, options)
+            duration = time.time() - start
+            queries = sql_counter(cr) - queries_start
+            cr.rollback()
+            # the products created for the benchmark are rolled back
+            env['product.product'].clear_caches()
+        with registry.cursor() as cr:
+            # the details of the OVH invoices are cached in a separate
+            # transaction
+            cr.execute(
+                "DELETE FROM ovh_invoice_info WHERE login = %s", (login,))
+    return {
+        'method': method,
+        'bills': bills,
+        'created': created,
+        'errors': len(errors),
+        'duration': duration,
+        'invoices_per_second': created / duration if duration else 0,
+        'queries_per_invoice': float(queries) / created if created else 0,
+        'memory_growth': peak_memory() - memory_start,
+        'timings': stats.timings,
+        }
+
+
+def check_regressions(results, baseline, tolerance):
+    regressions = []
+    for res in results:
+        key = '%s-%d' % (res['method'], res['bills'])
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        if res['invoices_per_second'] < (
+                base['invoices_per_second'] * (1 - tolerance)):
+            regressions.append('%s: %.1f invoices/s instead of %.1f' % (
+                key, res['invoices_per_second'],
+                base['invoices_per_second']))
+        if res['queries_per_invoice'] > (
+                base['queries_per_invoice'] * (1 + tolerance)):
+            regressions.append('%s: %.1f queries/invoice instead of %.1f' % (
+                key, res['queries_per_invoice'],
+                base['queries_per_invoice']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the import of the OVH invoices')
+    parser.add_argument('-c', '--config', help='Odoo configuration file')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument(
+        '--wsdl', required=True,
+        help='WSDL file written by ovh_soapi_standin.py')
+    parser.add_argument(
+        '--pdf-url', default='http://localhost:8079/facture.pdf',
+        help='URL of the PDF server of ovh_soapi_standin.py')
+    parser.add_argument(
+        '--methods', default=','.join(METHODS),
+        help='Methods of invoice line, separated by commas')
+    parser.add_argument(
+        '--sizes', default=','.join([str(size) for size in SIZES]),
+        help='Numbers of OVH invoices, separated by commas')
+    parser.add_argument(
+        '--lines', type=int, default=5,
+        help='Number of lines per OVH invoice')
+    parser.add_argument('--attach-pdf', action='store_true')
+    parser.add_argument('--auto-validate', action='store_true')
+    parser.add_argument('--save', help='Write the results in this file')
+    parser.add_argument(
+        '--baseline', help='Compare the results with this file')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='Tolerance of the comparison with the baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+    args.wsdl = os.path.abspath(args.wsdl)
+
+    config_args = ['-d', args.database]
+    if args.config:
+        config_args += ['-c', args.config]
+    openerp.tools.config.parse_config(config_args)
+    registry = openerp.registry(args.database)
+
+    results = []
+    print '%-12s %7s %8s %6s %10s %12s %11s' % (
+        'method', 'bills', 'created', 'errors', 'invoice/s', 'query/invoice',
+        'memory (MB)')
+    for method in args.methods.split(','):
+        # the sizes are run in increasing order, so that the growth of
+        # the peak memory is significant
+        for bills in sorted([int(size) for size in args.sizes.split(',')]):
+            res = run_case(registry, args, method, bills)
+            results.append(res)
+            print '%-12s %7d %8d %6d %10.1f %12.1f %11.1f' % (
+                method, bills, res['created'], res['errors'],
+                res['invoices_per_second'], res['queries_per_invoice'],
+                res['memory_growth'])
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(dict([
+                ('%s-%d' % (result['method'], result['bills']), result)
+                for result in results]), save_file, indent=2,
+                sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = check_regressions(
+                results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print 'REGRESSION %s' % regression
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
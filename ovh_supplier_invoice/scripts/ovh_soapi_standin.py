@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OVH Supplier Invoice module for Odoo
+#    Copyright (C) 2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""Local stand-in of the OVH SoAPI and of the PDF server of the OVH
+invoices, to run the import of the OVH invoices without OVH.
+
+It implements the queries login, logout, billingInvoiceList and
+billingInvoiceInfo of the WSDL 1.63 of the SoAPI, with synthetic OVH
+invoices. The number of OVH invoices of an account and the number of lines
+per invoice are given by the end of the login: 'bench-1000x20' has 1000
+invoices of 20 lines. The other logins have the default sizes given on
+the command line.
+
+Usage:
+
+    python ovh_soapi_standin.py --wsdl /tmp/ovh_standin.wsdl --latency 50
+
+then set the config parameters ovh_supplier_invoice.wsdl_path to
+/tmp/ovh_standin.wsdl and ovh_supplier_invoice.pdf_url to
+http://localhost:8079/facture.pdf in Odoo (see ovh_benchmark.py).
+"""
+
+from SOAPpy import ThreadingSOAPServer, faultType
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from datetime import datetime, timedelta
+import threading
+import argparse
+import logging
+import hashlib
+import urlparse
+import random
+import time
+import re
+
+logger = logging.getLogger('ovh_soapi_standin')
+
+NAMESPACE = 'http://soapi.ovh.com/manager'
+# The prefixes of the products of the demo data of the module
+SERVICES = [
+    'voip.line.0033123456789', 'voip.sms.pack.100', 'ip.failover',
+    'rebill.pack.voip.option']
+TAX_RATE = 0.2
+FIRST_BILL_DATE = datetime(2015, 1, 1)
+
+OPERATIONS = [
+    ('login', ['nic', 'password', 'language', 'multisession']),
+    ('logout', ['session']),
+    ('billingInvoiceList', ['session']),
+    ('billingInvoiceInfo', [
+        'session', 'billnum', 'password', 'country']),
+    ]
+
+WSDL_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<definitions name="managerService" targetNamespace="%(ns)s"
+    xmlns="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:tns="%(ns)s"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+%(messages)s
+<portType name="managerPortType">
+%(port_operations)s
+</portType>
+<binding name="managerBinding" type="tns:managerPortType">
+<soap:binding style="rpc" transport="http://schemas.xmlsoap.org/soap/http"/>
+%(binding_operations)s
+</binding>
+<service name="managerService">
+<port name="managerPort" binding="tns:managerBinding">
+<soap:address location="%(location)s"/>
+</port>
+</service>
+</definitions>
+"""
+
+BODY = (
+    '<soap:body use="encoded" namespace="%s" '
+    'encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"/>'
+    % NAMESPACE)
+
+
+def build_wsdl(location):
+    messages = []
+    port_operations = []
+    binding_operations = []
+    for name, params in OPERATIONS:
+        messages.append('<message name="%sRequest">%s</message>' % (
+            name, ''.join([
+                '<part name="%s" type="xsd:string"/>' % param
+                for param in params])))
+        messages.append(
+            '<message name="%sResponse">'
+            '<part name="return" type="xsd:anyType"/></message>' % name)
+        port_operations.append(
+            '<operation name="%s"><input message="tns:%sRequest"/>'
+            '<output message="tns:%sResponse"/></operation>'
+            % (name, name, name))
+        binding_operations.append(
+            '<operation name="%s"><soap:operation soapAction="%s"/>'
+            '<input>%s</input><output>%s</output></operation>'
+            % (name, name, BODY, BODY))
+    return WSDL_TEMPLATE % {
+        'ns': NAMESPACE,
+        'messages': '\n'.join(messages),
+        'port_operations': '\n'.join(port_operations),
+        'binding_operations': '\n'.join(binding_operations),
+        'location': location,
+        }
+
+
+class SyntheticOvh(object):
+    """Generates the OVH invoices of the accounts. The invoices of an
+    account only depend on its login, so they are the same for all the
+    imports"""
+
+    def __init__(self, bills, lines, latency, pdf_size):
+        self.bills = bills
+        self.lines = lines
+        self.latency = latency  # in seconds
+        self.pdf_size = pdf_size  # in bytes
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def account_size(self, login):
+        """Returns (number of invoices, number of lines per invoice)"""
+        match = re.search(r'(\d+)x(\d+)$', login or '')
+        if match:
+            return int(match.group(1)), int(match.group(2))
+        return self.bills, self.lines
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_login(self, session):
+        with self.lock:
+            if session not in self.sessions:
+                raise faultType(
+                    'soap:Server', 'Session %s is not valid' % session)
+            return self.sessions[session]
+
+    def bill_number(self, login, index):
+        prefix = hashlib.sha1(login).hexdigest()[:4].upper()
+        return 'FR%s%07d' % (prefix, index + 1)
+
+    def bill_index(self, login, billnum):
+        if billnum != self.bill_number(login, int(billnum[6:]) - 1):
+            raise faultType(
+                'soap:Server', 'Invoice %s not found' % billnum)
+        return int(billnum[6:]) - 1
+
+    def bill_lines(self, login, index):
+        lines = []
+        nb_lines = self.account_size(login)[1]
+        bill_date = FIRST_BILL_DATE + timedelta(minutes=30 * index)
+        start = bill_date.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        rand = random.Random('%s-%d' % (login, index))
+        for line in range(nb_lines):
+            service = SERVICES[(index + line) % len(SERVICES)]
+            quantity = rand.randint(1, 5)
+            price_unit = rand.randint(1, 10000) / 100.0
+            lines.append({
+                'service': service,
+                'domain': '%s.example.com' % login,
+                'description': 'Service %s' % service,
+                'start': start.strftime('%Y-%m-%d %H:%M:%S'),
+                'end': end.strftime('%Y-%m-%d %H:%M:%S'),
+                'quantity': quantity,
+                'baseprice': price_unit,
+                'totalprice': round(quantity * price_unit, 2),
+                })
+        return bill_date, lines
+
+    def bill_amounts(self, lines):
+        baseprice = round(sum([line['totalprice'] for line in lines]), 2)
+        tax = round(baseprice * TAX_RATE, 2)
+        return baseprice, tax, round(baseprice + tax, 2)
+
+    # SoAPI queries
+
+    def login(self, nic, password, language, multisession):
+        self.wait()
+        session = hashlib.sha1('%s-%s' % (nic, time.time())).hexdigest()
+        with self.lock:
+            self.sessions[session] = nic
+        return session
+
+    def logout(self, session):
+        with self.lock:
+            self.sessions.pop(session, None)
+        return True
+
+    def billingInvoiceList(self, session):
+        login = self.get_login(session)
+        self.wait()
+        items = []
+        for index in range(self.account_size(login)[0]):
+            bill_date, lines = self.bill_lines(login, index)
+            baseprice, tax, finalprice = self.bill_amounts(lines)
+            items.append({
+                'billnum': self.bill_number(login, index),
+                'date': bill_date.strftime('%Y-%m-%dT%H:%M:%S+01:00'),
+                'totalPrice': baseprice,
+                'totalPriceWithVat': finalprice,
+                })
+        return {'item': items}
+
+    def billingInvoiceInfo(self, session, billnum, password, country):
+        login = self.get_login(session)
+        self.wait()
+        index = self.bill_index(login, billnum)
+        bill_date, lines = self.bill_lines(login, index)
+        baseprice, tax, finalprice = self.bill_amounts(lines)
+        return {
+            'billnum': billnum,
+            'date': bill_date.strftime('%Y-%m-%dT%H:%M:%S+01:00'),
+            'baseprice': baseprice,
+            'tax': tax,
+            'finalprice': finalprice,
+            'taxrate': TAX_RATE,
+            'password': hashlib.sha1(billnum).hexdigest()[:8],
+            'details': {'item': lines},
+            }
+
+    def pdf(self, reference):
+        """Returns a minimal PDF file of pdf_size bytes"""
+        self.wait()
+        content = '%%PDF-1.4\n%% OVH invoice %s\n' % reference
+        padding = max(self.pdf_size - len(content) - 6, 0)
+        return content + '%' * padding + '\n%%EOF'
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def pdf_handler(ovh):
+
+    class PdfHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse.urlparse(self.path)
+            query = urlparse.parse_qs(url.query)
+            if url.path != '/facture.pdf' or not query.get('reference'):
+                self.send_error(404)
+                return
+            content = ovh.pdf(query['reference'][0])
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/pdf')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return PdfHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Stand-in of the OVH SoAPI and of the PDF server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument(
+        '--soap-port', type=int, default=8078,
+        help='Port of the SOAP service')
+    parser.add_argument(
+        '--pdf-port', type=int, default=8079,
+        help='Port of the PDF server')
+    parser.add_argument(
+        '--wsdl', default='ovh_standin.wsdl',
+        help='Path of the WSDL file to write, to be set in the config '
+        'parameter ovh_supplier_invoice.wsdl_path')
+    parser.add_argument(
+        '--bills', type=int, default=10,
+        help='Default number of OVH invoices per account')
+    parser.add_argument(
+        '--lines', type=int, default=5,
+        help='Default number of lines per OVH invoice')
+    parser.add_argument(
+        '--latency', type=int, default=0,
+        help='Latency of each query, in milliseconds')
+    parser.add_argument(
+        '--pdf-size', type=int, default=30,
+        help='Size of the PDF files, in kilobytes')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    ovh = SyntheticOvh(
+        args.bills, args.lines, args.latency / 1000.0, args.pdf_size * 1024)
+    with open(args.wsdl, 'w') as wsdl_file:
+        wsdl_file.write(build_wsdl(
+            'http://%s:%d/' % (args.host, args.soap_port)))
+    soap_server = ThreadingSOAPServer((args.host, args.soap_port))
+    for name, params in OPERATIONS:
+        soap_server.registerFunction(getattr(ovh, name), namespace=NAMESPACE)
+    pdf_server = ThreadingHTTPServer(
+        (args.host, args.pdf_port), pdf_handler(ovh))
+    pdf_thread = threading.Thread(target=pdf_server.serve_forever)
+    pdf_thread.daemon = True
+    pdf_thread.start()
+    logger.info(
+        'SoAPI stand-in on http://%s:%d/ (WSDL %s), PDF files on '
+        'http://%s:%d/facture.pdf', args.host, args.soap_port, args.wsdl,
+        args.host, args.pdf_port)
+    try:
+        soap_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
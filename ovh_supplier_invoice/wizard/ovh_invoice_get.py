@@ -20,19 +20,184 @@
 #
 ##############################################################################
 
-from openerp import models, fields, api, workflow, _
-from openerp.tools import float_compare
-from openerp.exceptions import Warning
+import openerp
+from openerp import models, fields, api, _
+from openerp import tools, SUPERUSER_ID
+from openerp.tools import float_compare, float_round
+from ..ovh_sync_run import SyncStats
+from ..ovh_invoice_info import OvhBill
+from ..ovh_soapi import get_soap_session, rate_limiter
+from ..ovh_rest import get_rest_client
+from openerp.exceptions import Warning, except_orm
 from SOAPpy import WSDL
+from multiprocessing.pool import ThreadPool
+from itertools import islice
+from collections import deque, OrderedDict
+from cStringIO import StringIO
+from contextlib import contextmanager
+import threading
 import requests
 import logging
+import tempfile
+import csv
+import hashlib
 import base64
+import time
+import os
+from email.utils import formataddr
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 
 logger = logging.getLogger(__name__)
 
+# Default number of parallel requests, which can be changed with the
+# config parameters ovh_supplier_invoice.soapi_workers,
+# ovh_supplier_invoice.pdf_download_workers and
+# ovh_supplier_invoice.account_workers
+SOAPI_WORKERS = 4
+# Number of OVH invoices per worker whose details are downloaded in advance
+DETAIL_BUFFER_SIZE = 2
+PDF_DOWNLOAD_WORKERS = 4
+ACCOUNT_WORKERS = 4
+# Fields of the lines of the OVH invoices in the CSV attachment
+DETAIL_CSV_COLUMNS = [
+    'service', 'domain', 'description', 'start', 'end', 'quantity',
+    'baseprice', 'totalprice']
+# Size of the chunks of the PDF files written in the filestore
+PDF_STREAM_CHUNK_SIZE = 64 * 1024
+# Number of invoices created, checked and validated together, which can be
+# changed with the config parameter ovh_supplier_invoice.create_chunk_size
+CREATE_CHUNK_SIZE = 50
+
+SOAPI_WSDL_VERSION = '1.63'
+SOAPI_WSDL_URL = 'https://www.ovh.com/soapi/soapi-re-%s.wsdl' % (
+    SOAPI_WSDL_VERSION)
+# Validity of the WSDL file in the cache, in hours
+WSDL_CACHE_TTL = 7 * 24
+# URL of the PDF files of the OVH invoices, which can be changed with the
+# config parameter ovh_supplier_invoice.pdf_url
+PDF_URL = 'https://www.ovh.com/cgi-bin/order/facture.pdf'
+# Names of the OVH APIs in the origin and in the note of the invoices
+API_NAMES = {'soapi': 'SoAPI', 'rest': 'REST API'}
+# Validity of a SoAPI session without activity, in minutes
+SOAPI_SESSION_TTL = 15
+# Limits of the requests to OVH for the whole process, which can be
+# changed with the config parameters
+# ovh_supplier_invoice.max_requests_per_second and
+# ovh_supplier_invoice.max_retries
+MAX_REQUESTS_PER_SECOND = 10
+MAX_RETRIES = 5
+# SOAP proxies already built in this process
+# key = (path of the WSDL file, date of the WSDL file)
+soap_proxies = {}
+soap_proxies_lock = threading.Lock()
+
+
+def split_every(n, iterable):
+    """Yields lists of n items of iterable (the last one may be shorter)"""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, n))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, n))
+
+
+@contextmanager
+def account_savepoint(cr, commit_every):
+    """Isolates the import of an OVH account in the transaction, so that
+    an SQL error doesn't abort the import of the next accounts. When the
+    import commits by itself (commit_every), the commits would release
+    the savepoint, so the transaction is rolled back to the last commit
+    instead"""
+    if not commit_every:
+        with cr.savepoint():
+            yield
+        return
+    try:
+        yield
+    except Exception:
+        cr.rollback()
+        raise
+
+
+class LastImportMark(object):
+    """Computes the new mark of the last import of an OVH account: the most
+    recent listed OVH invoice that is older than all the failed invoices,
+    so that the next imports start before the first failed invoice.
+    The bills are (date, number) and are added while they are streamed,
+    so the mark is moved back conservatively when an invoice fails."""
+
+    def __init__(self):
+        self.last_bill = None
+        self.first_failure = None
+
+    def add_bill(self, bill_date, bill_number):
+        bill = (bill_date, bill_number)
+        if self.first_failure is not None and bill >= self.first_failure:
+            return
+        if self.last_bill is None or bill > self.last_bill:
+            self.last_bill = bill
+
+    def add_failure(self, bill_date, bill_number):
+        bill = (bill_date, bill_number)
+        if self.first_failure is None or bill < self.first_failure:
+            self.first_failure = bill
+        if self.last_bill is not None and self.last_bill >= bill:
+            # the older listed invoices are not kept, so the mark
+            # is reset and only moved by the next listed invoices
+            self.last_bill = None
+
+
+def makedirs(dirname):
+    """Creates a directory of the filestore, which can be created at the
+    same time by another thread"""
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+
+def stream_to_filestore(response, filestore):
+    """Writes the content of the HTTP response in the filestore by chunks,
+    with the same path as ir.attachment (based on the SHA1 of the content).
+    Returns a dict with the keys store_fname and file_size"""
+    sha = hashlib.sha1()
+    size = 0
+    # the filestore of a new database is created with its first attachment
+    makedirs(filestore)
+    fd, tmp_path = tempfile.mkstemp(dir=filestore, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            for data in response.iter_content(PDF_STREAM_CHUNK_SIZE):
+                sha.update(data)
+                size += len(data)
+                tmp_file.write(data)
+        digest = sha.hexdigest()
+        # same logic as ir.attachment._get_path()
+        fname = digest[:3] + '/' + digest
+        if not os.path.isfile(os.path.join(filestore, fname)):
+            fname = digest[:2] + '/' + digest
+        full_path = os.path.join(filestore, fname)
+        if os.path.isfile(full_path):
+            os.unlink(tmp_path)
+        else:
+            makedirs(os.path.dirname(full_path))
+            os.rename(tmp_path, full_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return {'store_fname': fname, 'file_size': size}
+
+
+def exception_message(e):
+    if isinstance(e, except_orm):
+        return e.value
+    return tools.ustr(e)
+
 
 class OvhInvoiceGet(models.TransientModel):
     _name = 'ovh.invoice.get'
@@ -44,17 +209,52 @@ class OvhInvoiceGet(models.TransientModel):
 
     auto_validate = fields.Boolean(string='Auto Validate')
     from_date = fields.Date(string='From Date', default=_default_from_date)
+    full_resync = fields.Boolean(
+        string='Full Resync',
+        help="If set, the wizard will also look at the OVH invoices "
+        "dated before the last import of each OVH account.")
     attach_pdf = fields.Boolean(
         string='Attach PDF of OVH Invoice', default=True)
+    defer_pdf = fields.Boolean(
+        string='Download PDF Later',
+        help="If set, the PDF files are not downloaded during the import: "
+        "only their reference and password are stored on the invoices, "
+        "and the PDF files are downloaded later by a scheduled action or "
+        "when you click on the button 'Get OVH PDF' of the invoice.")
+    parallel_accounts = fields.Boolean(
+        string='Process Accounts in Parallel',
+        help="If set, the OVH accounts are processed at the same time, "
+        "each one in its own transaction: if the import fails on an "
+        "account, the invoices of the other accounts are kept.")
+    background = fields.Boolean(
+        string='Run in Background',
+        help="If set, the wizard creates an import job for each OVH "
+        "account and returns immediately. The jobs are processed by a "
+        "scheduled action.")
+    commit_every = fields.Integer(
+        string='Commit Every',
+        help="If set, the imported invoices are committed in the database "
+        "every N invoices, so that a long import that is interrupted "
+        "doesn't need to restart from the beginning. 0 means that the "
+        "invoices are committed at the end of the import.")
     account_ids = fields.One2many(
         'ovh.invoice.get.account', 'wizard_id', string='OVH Accounts')
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Done'),
+        ], string='State', readonly=True, default='draft')
+    report = fields.Text(string='Errors', readonly=True)
+    sync_run_id = fields.Many2one(
+        'ovh.sync.run', string='Import Run', readonly=True)
 
     @api.model
     def default_get(self, fields):
         res = super(OvhInvoiceGet, self).default_get(fields)
         accounts = []
+        # the OVH accounts of all the allowed companies of the user are
+        # imported in the same run
         ovh_accounts = self.env['ovh.account'].search(
-            [('company_id', '=', self.env.user.company_id.id)])
+            [('company_id', 'in', self.env.user.company_ids.ids)])
         for account in ovh_accounts:
             accounts.append({
                 'ovh_account_id': account.id,
@@ -63,14 +263,111 @@ class OvhInvoiceGet(models.TransientModel):
         res.update(account_ids=accounts)
         return res
 
+    @api.model
+    def _get_line_period(self, line):
+        """Returns the service period (start date, end date) of a line of
+        an OVH invoice, or False. OVH gives the day after the end date"""
+        if not line.start or not line.end:
+            return False
+        end_date_dt = fields.Date.from_string(line.end[:10])
+        end_date_dt -= relativedelta(days=1)
+        return (line.start[:10], fields.Date.to_string(end_date_dt))
+
+    @api.model
+    def _get_line_subtotal(self, il_vals):
+        """Returns the subtotal of the prepared values of an invoice line,
+        computed like Odoo does from the quantity and the unit price
+        rounded to the precision of their fields"""
+        dp = self.env['decimal.precision']
+        quantity = float_round(
+            il_vals['quantity'],
+            precision_digits=dp.precision_get('Product Unit of Measure'))
+        price_unit = float_round(
+            il_vals['price_unit'],
+            precision_digits=dp.precision_get('Product Price'))
+        return float_round(
+            quantity * price_unit,
+            precision_digits=dp.precision_get('Account'))
+
+    @api.model
+    def _group_invoice_line_vals(self, lines_vals):
+        """lines_vals is a list of (line, il_vals). Returns the list of
+        il_vals grouped by product or expense account, analytic account,
+        taxes and service period. The untaxed amount of a group is the sum
+        of the rounded subtotals of its lines, so that the untaxed total
+        of the invoice is not changed by the grouping"""
+        prec = self.env['decimal.precision'].precision_get('Account')
+        groups = OrderedDict()
+        for line, il_vals in lines_vals:
+            key = (
+                il_vals.get('product_id') or il_vals['account_id'],
+                il_vals.get('account_analytic_id') or False,
+                tuple(sorted(il_vals['invoice_line_tax_id'][0][2])),
+                self._get_line_period(line))
+            groups.setdefault(key, []).append(il_vals)
+        res = []
+        for key, group in groups.items():
+            il_vals = dict(group[0])
+            if len(group) > 1:
+                subtotal = float_round(sum([
+                    self._get_line_subtotal(vals) for vals in group]),
+                    precision_digits=prec)
+                quantity = sum([vals['quantity'] for vals in group])
+                price_unit = il_vals['price_unit']
+                if (
+                        any([vals['price_unit'] != price_unit
+                            for vals in group]) or
+                        float_compare(
+                            self._get_line_subtotal({
+                                'quantity': quantity,
+                                'price_unit': price_unit}),
+                            subtotal, precision_digits=prec)):
+                    # the subtotal can only be kept exactly with a
+                    # quantity of 1
+                    quantity = 1
+                    price_unit = subtotal
+                il_vals.update({
+                    'quantity': quantity,
+                    'price_unit': price_unit,
+                    })
+                if len(set([vals['name'] for vals in group])) > 1:
+                    if il_vals.get('product_id'):
+                        name = self.env['product.product'].browse(
+                            il_vals['product_id']).name
+                    else:
+                        name = _('OVH services')
+                    if key[3]:
+                        name = _('%s du %s au %s') % (
+                            name, key[3][0], key[3][1])
+                    il_vals['name'] = _('%s (%d lines)') % (
+                        name, len(group))
+            res.append(il_vals)
+        return res
+
+    @api.model
+    def _prepare_detail_csv(self, res_iinfo):
+        """Returns the detailed lines of an OVH invoice as a CSV file"""
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(DETAIL_CSV_COLUMNS)
+        for line in res_iinfo.details.item:
+            writer.writerow([
+                tools.ustr(line.get(column) or '').encode('utf-8')
+                for column in DETAIL_CSV_COLUMNS])
+        return output.getvalue()
+
     @api.model
     def _prepare_invoice_line_vals(
             self, line, invoice_desc, ovh_partner,
-            products, tax_id, taxrate):
+            products, tax_id, taxrate, cache=None):
+        # cache is a dict that lives for the whole import, used to
+        # avoid running the same onchange for each invoice line
+        if cache is None:
+            cache = {}
         logger.debug('OVH invoice line=%s', line)
         il_fake = self.env['account.invoice.line'].browse([])
         method = invoice_desc['account'].invoice_line_method
-        company = self.env.user.company_id
+        company = invoice_desc['account'].company_id
         if not line.baseprice:
             return False
         if method == 'no_product':
@@ -82,13 +379,9 @@ class OvhInvoiceGet(models.TransientModel):
                 }
         elif method == 'product':
             assert line.service, 'Missing service on OVH invoice line'
-            product = False
-            for pentry in products:
-                if line.service.startswith(pentry['service']):
-                    product = pentry['product']
-                    break
+            product = self.env['product.product'].browse(
+                products.match(line.service))
             if not product:
-                logger.debug('OVH products=%s', products)
                 raise Warning(_(
                     "For OVH invoice '%s' dated %s related to account '%s', "
                     "there are no OVH product matching service '%s' "
@@ -98,12 +391,26 @@ class OvhInvoiceGet(models.TransientModel):
                     invoice_desc['account'].login,
                     line.description,
                     line.service))
-            il_vals = il_fake.product_id_change(
-                product.id, product.uom_id.id, type='in_invoice',
-                partner_id=ovh_partner.id,
-                fposition_id=ovh_partner.property_account_position.id,
-                currency_id=company.currency_id.id,
-                company_id=company.id)['value']
+            fposition_id = ovh_partner.with_context(
+                force_company=company.id).property_account_position.id
+            cache_key = (
+                'product_id_change', product.id, ovh_partner.id,
+                fposition_id, company.id)
+            if cache_key not in cache:
+                il_vals = il_fake.product_id_change(
+                    product.id, product.uom_id.id, type='in_invoice',
+                    partner_id=ovh_partner.id,
+                    fposition_id=fposition_id,
+                    currency_id=company.currency_id.id,
+                    company_id=company.id)['value']
+                # the OVH products are shared by the companies, so they
+                # can have the purchase taxes of several companies
+                il_vals['invoice_line_tax_id'] = self.env[
+                    'account.tax'].browse(
+                    il_vals.get('invoice_line_tax_id') or []).filtered(
+                    lambda tax: tax.company_id == company).ids
+                cache[cache_key] = il_vals
+            il_vals = dict(cache[cache_key])
             if il_vals['invoice_line_tax_id']:
                 tax = self.env['account.tax'].browse(
                     il_vals['invoice_line_tax_id'][0])
@@ -138,12 +445,9 @@ class OvhInvoiceGet(models.TransientModel):
             'price_unit': float(line.baseprice),
             'name': line.description,
             })
-        if line.start and line.end:
-            start_date_str = line.start[:10]
-            end_date_str = line.end[:10]
-            end_date_dt = fields.Date.from_string(end_date_str)
-            end_date_dt -= relativedelta(days=1)
-            end_date_str = fields.Date.to_string(end_date_dt)
+        period = self._get_line_period(line)
+        if period:
+            start_date_str, end_date_str = period
             il_vals['name'] = _('%s du %s au %s') % (
                 line.description, start_date_str, end_date_str)
             if (
@@ -161,280 +465,1335 @@ class OvhInvoiceGet(models.TransientModel):
                     il_vals.get('name')))
         return il_vals
 
+    @api.model
+    def _get_bill_taxrate(self, invoice_desc, res_iinfo, company, cache):
+        """Returns the tax rate of the OVH invoice. When the rate is
+        derived from the rounded amounts of the invoice (REST API), it is
+        replaced by the nearest rate of the purchase taxes of the company
+        that gives the tax amount of the invoice"""
+        taxrate = float(res_iinfo.taxrate)
+        if not res_iinfo.get('taxrate_derived'):
+            return taxrate
+        cache_key = ('purchase_tax_rates', company.id)
+        if cache_key not in cache:
+            taxes = self.env['account.tax'].search_read([
+                ('type_tax_use', '=', 'purchase'),
+                ('type', '=', 'percent'),
+                ('price_include', '=', False),
+                ('company_id', '=', company.id),
+                ], ['amount'])
+            cache[cache_key] = list(set([tax['amount'] for tax in taxes]))
+        prec = self.env['decimal.precision'].precision_get('Account')
+        baseprice = float(res_iinfo.baseprice)
+        tax = float(res_iinfo.tax)
+        # the tax amount and the lines of the invoice are rounded
+        # separately, so the tax amount can differ by half a cent per line
+        # plus half a cent (one cent for an invoice with one line)
+        tolerance = (
+            (len(res_iinfo.details.item) + 1) * 0.5 + 0.01) * 10 ** -prec
+        rates = [
+            rate for rate in cache[cache_key]
+            if abs(baseprice * rate - tax) <= tolerance]
+        if not rates:
+            raise Warning(_(
+                "For invoice '%s' dated %s related to account '%s', "
+                "could not find proper purchase tax in Odoo "
+                "with a rate of about %.2f %%") % (
+                invoice_desc['number'], invoice_desc['date'],
+                invoice_desc['account'].login, taxrate * 100))
+        return min(rates, key=lambda rate: abs(rate - taxrate))
+
     @api.model
     def _prepare_invoice_vals(
-            self, invoice_desc, ovh_partner, res_iinfo, products):
+            self, invoice_desc, ovh_partner, res_iinfo, products,
+            cache=None):
+        if cache is None:
+            cache = {}
         aio = self.env['account.invoice']
-        company = self.env.user.company_id
+        company = invoice_desc['account'].company_id
+        cache_key = ('partner_vals', ovh_partner.id, company.id)
+        if cache_key not in cache:
+            partner_vals = aio.onchange_partner_id(
+                'in_invoice', ovh_partner.id,
+                company_id=company.id)['value']
+            partner_vals['journal_id'] = aio.with_context(
+                type='in_invoice', company_id=company.id
+                )._default_journal().id
+            cache[cache_key] = partner_vals
         vals = {
             'partner_id': ovh_partner.id,
             'type': 'in_invoice',
             'company_id': company.id,
             'supplier_invoice_number': invoice_desc['number'],
-            'origin': 'OVH SoAPI %s' % invoice_desc['account'].login,
+            'ovh_account_id': invoice_desc['account'].id,
+            'user_id': self._context.get('ovh_import_uid', self._uid),
+            'origin': 'OVH %s %s' % (
+                API_NAMES[invoice_desc['account'].api_type],
+                invoice_desc['account'].login),
             'date_invoice': res_iinfo.date[:10],
-            'journal_id':
-            aio.with_context(type='in_invoice')._default_journal().id,
             'invoice_line': [],
             'check_total': float(res_iinfo.finalprice),
             }
-        vals.update(aio.onchange_partner_id(
-            'in_invoice', ovh_partner.id, company_id=company.id)['value'])
-        taxrate = float(res_iinfo.taxrate)  # =0.2 for 20%
+        vals.update(cache[cache_key])
+        taxrate = self._get_bill_taxrate(
+            invoice_desc, res_iinfo, company, cache)  # =0.2 for 20%
         method = invoice_desc['account'].invoice_line_method
         tax_id = False
         if method == 'no_product':
-            taxes = self.env['account.tax'].search([
-                ('type_tax_use', '=', 'purchase'),
-                ('amount', '=', taxrate),
-                ('type', '=', 'percent'),
-                ('price_include', '=', False),
-                ])
-            if len(taxes) < 1:
-                raise Warning(_(
-                    "For invoice '%s' dated %s related to account '%s', "
-                    "could not find proper purchase tax in Odoo "
-                    "with a rate of %s %%") % (
-                    invoice_desc['number'], invoice_desc['date'],
-                    invoice_desc['account'].login, taxrate * 100))
-            # TODO: we take the first one, which correspond to the
-            # regular tax (the other ones are IMMO-20.0 & ACH_UE_ded.-20.0)
-            tax_id = taxes[0].id
-        if isinstance(res_iinfo.details.item, list):
-            for line in res_iinfo.details.item:
-                il_vals = self._prepare_invoice_line_vals(
-                    line, invoice_desc, ovh_partner,
-                    products, tax_id, taxrate)
-                if il_vals:
-                    vals['invoice_line'].append((0, 0, il_vals))
-        # When we have only 1 invoice line
-        else:
+            cache_key = ('purchase_tax', company.id, taxrate)
+            if cache_key not in cache:
+                taxes = self.env['account.tax'].search([
+                    ('type_tax_use', '=', 'purchase'),
+                    ('amount', '=', taxrate),
+                    ('type', '=', 'percent'),
+                    ('price_include', '=', False),
+                    ('company_id', '=', company.id),
+                    ])
+                if len(taxes) < 1:
+                    raise Warning(_(
+                        "For invoice '%s' dated %s related to account '%s', "
+                        "could not find proper purchase tax in Odoo "
+                        "with a rate of %s %%") % (
+                        invoice_desc['number'], invoice_desc['date'],
+                        invoice_desc['account'].login, taxrate * 100))
+                # TODO: we take the first one, which correspond to the
+                # regular tax (the other ones are IMMO-20.0 &
+                # ACH_UE_ded.-20.0)
+                cache[cache_key] = taxes[0].id
+            tax_id = cache[cache_key]
+        # res_iinfo is an OvhBill, so details.item is always a list
+        lines_vals = []
+        for line in res_iinfo.details.item:
             il_vals = self._prepare_invoice_line_vals(
-                res_iinfo.details.item, invoice_desc,
-                ovh_partner, products, tax_id, taxrate)
+                line, invoice_desc, ovh_partner,
+                products, tax_id, taxrate, cache=cache)
             if il_vals:
-                vals['invoice_line'].append((0, 0, il_vals))
+                lines_vals.append((line, il_vals))
+        if invoice_desc['account'].group_invoice_lines:
+            lines_il_vals = self._group_invoice_line_vals(lines_vals)
+        else:
+            lines_il_vals = [
+                line_vals for dummy, line_vals in lines_vals]
+        vals['invoice_line'] = [
+            (0, 0, line_vals) for line_vals in lines_il_vals]
         return vals
 
-    def ovh_invoice_attach_pdf(
-            self, invoice, invoice_desc, invoice_password):
+    def ovh_invoice_download_pdf(
+            self, http_session, invoice_desc, invoice_password,
+            filestore=None, pdf_url=PDF_URL):
+        """Downloads the PDF of an OVH invoice. If filestore is set, the
+        PDF is streamed by chunks into the filestore, in a file named
+        after its SHA1 like the ones of ir.attachment, so an identical
+        PDF is never stored twice. Returns a dict with the keys
+        status_code and store_fname + file_size (or content if filestore
+        is not set), or None if the download failed."""
+        # This method is executed in a worker thread of the PDF download
+        # pool, so it must not use the ORM
         logger.info(
             'Starting to download PDF of OVH invoice %s dated %s',
             invoice_desc['number'], invoice_desc['date'])
-        url = 'https://www.ovh.com/cgi-bin/order/facture.pdf?'
-        url += 'reference=%s&passwd=%s' % (
-            invoice_desc['number'], invoice_password)
+        # the bills of the REST API give the URL of their PDF
+        url = invoice_desc.get('pdf_url') or '%s?reference=%s&passwd=%s' % (
+            pdf_url, invoice_desc['number'], invoice_password)
         logger.debug('OVH invoice download url: %s', url)
-        rpdf = requests.get(url)
-        logger.info(
-            'OVH invoice PDF download HTTP code: %s', rpdf.status_code)
-        if rpdf.status_code == 200:
-            self.env['ir.attachment'].create({
-                'name': 'OVH_invoice_%s.pdf' % invoice_desc['number'],
+        try:
+            rpdf = rate_limiter.call(
+                http_session.get, url, timeout=60, stream=True)
+            try:
+                logger.info(
+                    'OVH invoice PDF download HTTP code: %s',
+                    rpdf.status_code)
+                res = {'status_code': rpdf.status_code}
+                if rpdf.status_code == 200:
+                    if filestore:
+                        res.update(stream_to_filestore(rpdf, filestore))
+                    else:
+                        res['content'] = rpdf.content
+            finally:
+                rpdf.close()
+        except (requests.exceptions.RequestException, IOError, OSError), e:
+            logger.warning(
+                'Could not download the PDF of the OVH invoice %s: %s',
+                invoice_desc['number'], e)
+            return None
+        return res
+
+    def ovh_invoice_attach_pdf(
+            self, invoice, invoice_desc, pdf, messages=None):
+        """pdf is the result of ovh_invoice_download_pdf().
+        Returns True if the PDF has been attached"""
+        if pdf is None:
+            self.post_note(
+                invoice,
+                _('Failed to download the PDF file of the OVH invoice.'),
+                messages=messages)
+            return False
+        elif pdf['status_code'] == 200:
+            name = 'OVH_invoice_%s.pdf' % invoice_desc['number']
+            vals = {
+                'name': name,
+                'datas_fname': name,
                 'res_id': invoice.id,
                 'res_model': 'account.invoice',
-                'datas': base64.encodestring(rpdf.content),
-                })
+                }
+            if pdf.get('store_fname'):
+                vals['store_fname'] = pdf['store_fname']
+            else:
+                vals['datas'] = base64.encodestring(pdf['content'])
+            attachment = self.env['ir.attachment'].create(vals)
+            if pdf.get('store_fname'):
+                # ir.attachment.create() drops file_size, which is
+                # normally computed when datas is written
+                self._cr.execute(
+                    'UPDATE ir_attachment SET file_size = %s WHERE id = %s',
+                    (pdf['file_size'], attachment.id))
             logger.info(
                 'Attachement created on OVH invoice %s dated %s',
                 invoice_desc['number'], invoice_desc['date'])
-            invoice.message_post(_(
+            self.post_note(invoice, _(
                 '<p>The PDF file of the OVH invoice has been '
                 'successfully downloaded. You can get it in '
-                'the attachments.'))
+                'the attachments.'), messages=messages)
+            return True
         else:
             logger.warning(
                 'Could not download the PDF of the OVH invoice %s. '
-                'HTTP error %d', invoice_desc['number'], rpdf.status_code)
-            invoice.message_post(
+                'HTTP error %d', invoice_desc['number'], pdf['status_code'])
+            self.post_note(
+                invoice,
                 _('Failed to download the PDF file of the OVH '
-                    'invoice (HTTP error %d') % rpdf.status_code)
+                    'invoice (HTTP error %d') % pdf['status_code'],
+                messages=messages)
+            return False
+
+    def ovh_invoices_attach_pdf(self, pdf_todo, stats=None, messages=None):
+        """pdf_todo is a list of (invoice, invoice_desc, invoice_password).
+        The PDF files are downloaded in parallel through a shared HTTP
+        session, then the attachments are created in the current thread.
+        Returns the invoices that have their PDF attached"""
+        if not pdf_todo:
+            return self.env['account.invoice'].browse(False)
+        if stats is None:
+            stats = SyncStats()
+        with stats.timer('pdf'):
+            return self._ovh_invoices_attach_pdf(pdf_todo, stats, messages)
+
+    def _ovh_invoices_attach_pdf(self, pdf_todo, stats, messages):
+        iao = self.env['ir.attachment']
+        # The PDF of an OVH invoice that is already attached to the same
+        # invoice, or that is in the filestore because the same OVH invoice
+        # was imported in another company, is not downloaded again
+        names = [
+            'OVH_invoice_%s.pdf' % invoice_desc['number']
+            for invoice, invoice_desc, invoice_password in pdf_todo]
+        attached = set()
+        stored = {}
+        res = self.env['account.invoice'].browse(False)
+        for att in iao.search_read([
+                ('res_model', '=', 'account.invoice'),
+                ('name', 'in', names),
+                ], ['name', 'res_id', 'store_fname', 'file_size']):
+            attached.add((att['name'], att['res_id']))
+            # the attachments stored in the database are not shared
+            if att['store_fname']:
+                stored[att['name']] = att
+        to_download = []
+        for invoice, invoice_desc, invoice_password in pdf_todo:
+            name = 'OVH_invoice_%s.pdf' % invoice_desc['number']
+            if (name, invoice.id) in attached:
+                res += invoice
+            elif name in stored:
+                self.ovh_invoice_attach_pdf(invoice, invoice_desc, {
+                    'status_code': 200,
+                    'store_fname': stored[name]['store_fname'],
+                    'file_size': stored[name]['file_size'],
+                    }, messages=messages)
+                stats.incr('pdf_reused')
+                res += invoice
+            else:
+                to_download.append(
+                    (invoice, invoice_desc, invoice_password))
+        if not to_download:
+            return res
+        filestore = False
+        if self.pool['ir.attachment']._storage(self._cr, self._uid) == 'file':
+            filestore = tools.config.filestore(self._cr.dbname)
+        pdf_url = self.env['ir.config_parameter'].sudo().get_param(
+            'ovh_supplier_invoice.pdf_url') or PDF_URL
+        workers = min(
+            self.get_int_param(
+                'ovh_supplier_invoice.pdf_download_workers',
+                PDF_DOWNLOAD_WORKERS),
+            len(to_download))
+        http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=workers)
+        http_session.mount('https://', adapter)
+        pool = ThreadPool(workers)
+        try:
+            pdfs = pool.map(
+                lambda todo: self.ovh_invoice_download_pdf(
+                    http_session, todo[1], todo[2], filestore=filestore,
+                    pdf_url=pdf_url),
+                to_download)
+        finally:
+            pool.close()
+            pool.join()
+            http_session.close()
+        for (invoice, invoice_desc, invoice_password), pdf in zip(
+                to_download, pdfs):
+            if self.ovh_invoice_attach_pdf(
+                    invoice, invoice_desc, pdf, messages=messages):
+                stats.incr('pdf_downloaded')
+                res += invoice
+        return res
 
     def get_ovh_products(self):
-        products = self.env['product.product'].search([
-            ('default_code', 'like', 'OVH-%')])
-        unsorted_products = []
-        sorted_products = []
-        # [{'service': 'voip.sms.', 'product': product_recordset}]
-        for product in products:
-            unsorted_products.append(
-                {'service': product.default_code[4:], 'product': product})
-        # sort by len of service prefix, so that the longest prefix
-        # match in priority
-        if unsorted_products:
-            sorted_products = sorted(
-                unsorted_products,
-                key=lambda mydict: len(mydict['service']) * -1)
-        return sorted_products
+        """Returns the index of the OVH products by service prefix"""
+        return self.pool['product.product']._get_ovh_service_index(
+            self._cr, self._uid)
 
-    @api.multi
-    def get(self):
-        self.ensure_one()
-        aio = self.env['account.invoice']
-        soap = WSDL.Proxy('https://www.ovh.com/soapi/soapi-re-1.63.wsdl')
-        user = self.env.user
-        if not user.company_id.country_id:
-            raise Warning(
-                _('Missing country on company %s') % user.company_id.name)
-        country_code = user.company_id.country_id.code.lower()
-        partner = self.env['res.partner'].search([
-            ('sanitized_vat', '=', 'FR22424761419'),
-            ('parent_id', '=', False),
-            ('supplier', '=', 'True')])
-        if not partner:
-            raise Warning(
-                _("Couldn't find the supplier OVH. Make sure you have "
-                    "a supplier OVH with VAT number FR22424761419."))
-        ovh_partner = partner[0]
-        products = self.get_ovh_products()
+    @api.model
+    def get_wsdl_path(self):
+        """Returns the path of a local copy of the WSDL of the OVH SoAPI.
+        The WSDL is downloaded in the filestore (or in the directory given
+        by the config parameter ovh_supplier_invoice.wsdl_cache_dir)
+        and refreshed when it is older than the TTL. The config parameter
+        ovh_supplier_invoice.wsdl_path can give the path of a local WSDL
+        that will be used as-is (useful for tests)."""
+        icpo = self.env['ir.config_parameter'].sudo()
+        local_wsdl = icpo.get_param('ovh_supplier_invoice.wsdl_path')
+        if local_wsdl:
+            if not os.path.isfile(local_wsdl):
+                raise Warning(_(
+                    "The WSDL file '%s' of the OVH SoAPI doesn't exist.")
+                    % local_wsdl)
+            return local_wsdl
+        cache_dir = icpo.get_param('ovh_supplier_invoice.wsdl_cache_dir')
+        if not cache_dir:
+            cache_dir = os.path.join(
+                tools.config.filestore(self._cr.dbname), 'ovh_soapi')
+        wsdl_path = os.path.join(
+            cache_dir, 'soapi-re-%s.wsdl' % SOAPI_WSDL_VERSION)
+        ttl = self.get_int_param(
+            'ovh_supplier_invoice.wsdl_cache_ttl', WSDL_CACHE_TTL)
+        if (
+                os.path.isfile(wsdl_path) and
+                time.time() - os.path.getmtime(wsdl_path) < ttl * 3600):
+            return wsdl_path
+        logger.info('Downloading the WSDL of the OVH SoAPI from %s',
+                    SOAPI_WSDL_URL)
+        try:
+            rwsdl = rate_limiter.call(
+                requests.get, SOAPI_WSDL_URL, timeout=60)
+            rwsdl.raise_for_status()
+        except Exception, e:
+            if os.path.isfile(wsdl_path):
+                logger.warning(
+                    'Failed to refresh the WSDL of the OVH SoAPI (%s). '
+                    'Using the cached WSDL %s', e, wsdl_path)
+                return wsdl_path
+            raise Warning(_(
+                "Cannot download the WSDL of the OVH SoAPI. "
+                "The error message is '%s'.") % unicode(e))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write in a temp file then rename, so that other processes
+        # never read a partial WSDL
+        tmp_path = '%s.%d.%d.tmp' % (
+            wsdl_path, os.getpid(), threading.current_thread().ident)
+        with open(tmp_path, 'wb') as tmp_file:
+            tmp_file.write(rwsdl.content)
+        os.rename(tmp_path, wsdl_path)
+        return wsdl_path
 
-        invoices = aio.browse(False)
-        for account in self.account_ids:
-            ovh_account = account.ovh_account_id
-            logger.info(
-                'Opening SOAP session to OVH (account %s, country %s)',
-                ovh_account.login, country_code)
+    @api.model
+    def get_soap_proxy(self):
+        wsdl_path = self.get_wsdl_path()
+        key = (wsdl_path, os.path.getmtime(wsdl_path))
+        with soap_proxies_lock:
+            if key not in soap_proxies:
+                logger.info('Parsing the WSDL of the OVH SoAPI %s', wsdl_path)
+                for old_key in soap_proxies.keys():
+                    if old_key[0] == wsdl_path:
+                        del soap_proxies[old_key]
+                soap_proxies[key] = WSDL.Proxy(wsdl_path)
+            return soap_proxies[key]
+
+    def ovh_invoice_info_iter(
+            self, fetch_bill, items, stats=None, failures=None):
+        """Generator that yields (invoice_desc, res_iinfo) in the order
+        of items, which is an iterable of (invoice_desc, cached_bill),
+        where res_iinfo is the OvhBill returned by fetch_bill(invoice_desc)
+        (see get_bill_source()). The queries are sent in parallel by a
+        pool of threads, so that the next invoices are downloaded while the
+        current one is created in Odoo. The invoices that have a
+        cached_bill are not queried. At most DETAIL_BUFFER_SIZE invoices
+        per worker are downloaded in advance, so that the memory doesn't
+        depend on the number of invoices.
+        The invoices whose query fails are not yielded: they are added to
+        failures as (invoice_desc, error_message)."""
+        if stats is None:
+            stats = SyncStats()
+        if failures is None:
+            failures = []
+
+        def billing_invoice_info(invoice_desc, cached_bill):
+            # Executed in a worker thread: must not use the ORM
+            if cached_bill:
+                stats.incr('detail_cached')
+                return (invoice_desc, cached_bill, None)
             try:
-                session = soap.login(
-                    ovh_account.login,
-                    account.password,
-                    country_code, 0)
+                with stats.timer('detail'):
+                    res_iinfo = fetch_bill(invoice_desc)
             except Exception, e:
-                raise Warning(_(
-                    "Cannot connect to the OVH SoAPI with login '%s'. "
-                    "The error message is '%s'.")
-                    % (ovh_account.login, unicode(e)))
+                logger.warning(
+                    'Failed to get the details of the OVH invoice %s '
+                    'dated %s: %s',
+                    invoice_desc['number'], invoice_desc['date'], e)
+                return (invoice_desc, None, exception_message(e))
+            logger.debug(
+                'Details of OVH invoice %s: %s',
+                invoice_desc['number'], res_iinfo)
+            return (invoice_desc, res_iinfo, None)
+
+        def results():
+            for item in items:
+                pending.append(pool.apply_async(billing_invoice_info, item))
+                if len(pending) >= workers * DETAIL_BUFFER_SIZE:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+        workers = self.get_int_param(
+            'ovh_supplier_invoice.soapi_workers', SOAPI_WORKERS)
+        pool = ThreadPool(workers)
+        pending = deque()
+        try:
+            for invoice_desc, res_iinfo, error in results():
+                if error:
+                    failures.append((invoice_desc, error))
+                else:
+                    yield (invoice_desc, res_iinfo)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @api.model
+    def get_int_param(self, key, default):
+        value = self.env['ir.config_parameter'].sudo().get_param(key)
+        try:
+            return max(int(value), 1) if value else default
+        except ValueError:
+            logger.warning(
+                'Wrong value for config parameter %s: %s', key, value)
+            return default
+
+    @api.model
+    def configure_rate_limiter(self):
+        rate = self.get_int_param(
+            'ovh_supplier_invoice.max_requests_per_second',
+            MAX_REQUESTS_PER_SECOND)
+        rate_limiter.configure(
+            rate, rate,
+            self.get_int_param(
+                'ovh_supplier_invoice.max_retries', MAX_RETRIES))
+
+    @api.model
+    def report_progress(self, options, phase, **counters):
+        """Calls the progress callback of the background jobs, if any"""
+        if options.get('progress'):
+            options['progress'](phase, **counters)
+
+    @api.model
+    def get_existing_invoice_numbers(self, ovh_partner, numbers):
+        if not numbers:
+            return set()
+        existing_invs = self.env['account.invoice'].search_read([
+            ('type', '=', 'in_invoice'),
+            ('partner_id', '=', ovh_partner.id),
+            ('supplier_invoice_number', 'in', numbers),
+            ], ['supplier_invoice_number'])
+        return set([inv['supplier_invoice_number'] for inv in existing_invs])
+
+    @api.model
+    def _compute_invoice_amounts(self, vals, cache=None):
+        """Computes (untaxed amount, tax amount) of an invoice from its
+        prepared values, rounded like Odoo does. Returns None if a tax of
+        the invoice is not a simple percentage excluded from the price,
+        as its amount cannot be computed without the ORM"""
+        if cache is None:
+            cache = {}
+        prec = self.env['decimal.precision'].precision_get('Account')
+        company = self.env['res.company'].browse(vals['company_id'])
+        round_globally = (
+            company.tax_calculation_rounding_method == 'round_globally')
+        untaxed = 0.0
+        tax_amounts = {}
+        for il_vals in [line[2] for line in vals['invoice_line']]:
+            base = self._get_line_subtotal(il_vals)
+            untaxed += base
+            for tax_id in il_vals['invoice_line_tax_id'][0][2]:
+                cache_key = ('tax_rate', tax_id)
+                if cache_key not in cache:
+                    tax = self.env['account.tax'].browse(tax_id)
+                    if (
+                            tax.type == 'percent' and
+                            not tax.price_include and
+                            not tax.include_base_amount and
+                            not tax.child_ids):
+                        cache[cache_key] = tax.amount
+                    else:
+                        cache[cache_key] = None
+                if cache[cache_key] is None:
+                    return None
+                amount = base * cache[cache_key]
+                if not round_globally:
+                    amount = float_round(amount, precision_digits=prec)
+                tax_amounts[tax_id] = tax_amounts.get(tax_id, 0.0) + amount
+        tax_amount = sum([
+            float_round(tax_line_amount, precision_digits=prec)
+            for tax_line_amount in tax_amounts.values()])
+        return (
+            float_round(untaxed, precision_digits=prec),
+            float_round(tax_amount, precision_digits=prec))
+
+    @api.model
+    def _check_invoice_amounts(
+            self, invoice_desc, res_iinfo, vals, cache=None):
+        """Checks the amounts computed from the prepared values of the
+        invoice against the amounts of the OVH invoice, before the
+        invoice is created. Raises if the untaxed amounts don't match"""
+        amounts = self._compute_invoice_amounts(vals, cache=cache)
+        if amounts is None:
+            # checked after the creation of the invoice
+            return
+        amount_untaxed, amount_tax = amounts
+        prec = self.env['decimal.precision'].precision_get('Account')
+        if float_compare(
+                float(res_iinfo.baseprice), amount_untaxed,
+                precision_digits=prec):
+            raise Warning(_(
+                "For OVH invoice '%s' dated %s related to "
+                "account '%s', "
+                "the total untaxed amount is %.2f "
+                "whereas the total untaxed amount in Odoo is %.2f.")
+                % (invoice_desc['number'], invoice_desc['date'],
+                    invoice_desc['account'].login,
+                    float(res_iinfo.baseprice), amount_untaxed))
+        if float_compare(
+                float(res_iinfo.finalprice), amount_untaxed + amount_tax,
+                precision_digits=prec):
             logger.info(
-                'Starting OVH soAPI query billingInvoiceList (account %s)',
-                ovh_account.login)
-            res_ilist = soap.billingInvoiceList(session)
-            logger.debug('result billingInvoiceList=%s', res_ilist)
-
-            for oinv in res_ilist.item:
-                oinv_num = oinv.billnum
-                oinv_date = oinv.date[:10]
-                invoice_desc = {
-                    'number': oinv_num,
-                    'date': oinv_date,
-                    'account': ovh_account,  # object
-                    }
-                if self.from_date:
-                    if oinv_date < self.from_date:
-                        logger.info(
-                            "Skipping OVH invoice %s dated %s related to "
-                            " account %s because too old",
-                            invoice_desc['number'], invoice_desc['date'],
-                            invoice_desc['account'].login)
-                        continue
-                logger.info(
-                    "billingInvoiceList: OVH invoice number %s dated %s "
-                    "related to account %s",
-                    invoice_desc['number'], invoice_desc['date'],
-                    invoice_desc['account'].login)
-                if not oinv.totalPrice and not oinv.totalPriceWithVat:
-                    logger.info(
-                        'Skipping OVH invoice %s dated %s related to '
-                        'account %s because the amount is 0',
-                        invoice_desc['number'], invoice_desc['date'],
-                        invoice_desc['account'].login)
+                'The tax amount of the OVH invoice %s (%s) differs from '
+                'the tax amount computed by Odoo (%s): it will be forced',
+                invoice_desc['number'], res_iinfo.tax, amount_tax)
+
+    @api.model
+    def prepare_invoices(
+            self, chunk, ovh_partner, products, options, failures,
+            cache=None, stats=None):
+        """chunk is a list of (invoice_desc, res_iinfo). Prepares the
+        values of the invoices and checks their amounts, so that the
+        invoices that would not match the OVH invoices are rejected
+        before anything is written in the database. They are added to
+        failures as (invoice_desc, error_message).
+        Returns a list of (invoice_desc, res_iinfo, vals)"""
+        if stats is None:
+            stats = SyncStats()
+        res = []
+        with stats.timer('prepare'):
+            for invoice_desc, res_iinfo in chunk:
+                try:
+                    vals = self._prepare_invoice_vals(
+                        invoice_desc, ovh_partner, res_iinfo, products,
+                        cache=cache)
+                    self._check_invoice_amounts(
+                        invoice_desc, res_iinfo, vals, cache=cache)
+                except Exception, e:
+                    logger.warning(
+                        'Failed to prepare the OVH invoice %s dated %s '
+                        'related to account %s: %s', invoice_desc['number'],
+                        invoice_desc['date'], invoice_desc['account'].login,
+                        e)
+                    failures.append((invoice_desc, exception_message(e)))
                     continue
-                if oinv_num and oinv_num.startswith('PP_'):
+                if options['attach_pdf'] and options.get('defer_pdf'):
+                    # The PDF will be downloaded later
+                    vals.update({
+                        'ovh_pdf_reference': invoice_desc['number'],
+                        'ovh_pdf_password': res_iinfo.password,
+                        'ovh_pdf_pending': True,
+                        })
+                if options.get('sync_run_id'):
+                    vals['ovh_sync_run_id'] = options['sync_run_id']
+                res.append((invoice_desc, res_iinfo, vals))
+        return res
+
+    @api.model
+    def post_note(self, invoice, body, messages=None):
+        """Posts a note on an imported invoice. If messages is a dict,
+        the note is added to it, to be written later by flush_notes()"""
+        if messages is None:
+            invoice.message_post(
+                body, author_id=self.get_import_user().partner_id.id)
+        else:
+            messages.setdefault(invoice.id, []).append(body)
+
+    @api.model
+    def flush_notes(self, messages):
+        """Writes the notes {invoice_id: [note]} collected by post_note()
+        as one message per invoice, with a single query. The notes are not
+        sent to anybody, so the notifications of message_post() are not
+        needed"""
+        if not messages:
+            return
+        import_user = self.get_import_user()
+        author = import_user.partner_id
+        email_from = author.email and formataddr(
+            (author.name, author.email)) or False
+        now = fields.Datetime.now()
+        record_names = dict(
+            self.env['account.invoice'].browse(messages.keys()).name_get())
+        rows = []
+        for invoice_id, notes in messages.items():
+            body = ''.join([
+                note.startswith('<') and note or '<p>%s</p>' % note
+                for note in notes])
+            rows.append((
+                'account.invoice', invoice_id, record_names[invoice_id],
+                body, 'notification', author.id, email_from, now,
+                import_user.id, now, import_user.id, now))
+        self._cr.execute(
+            "INSERT INTO mail_message (model, res_id, record_name, body, "
+            "type, author_id, email_from, date, create_uid, create_date, "
+            "write_uid, write_date) VALUES %s" % ', '.join(['%s'] * len(rows)),
+            rows)
+        messages.clear()
+
+    @api.model
+    def create_invoices(self, chunk, options, stats=None, messages=None):
+        """chunk is a list of (invoice_desc, res_iinfo, vals), as returned
+        by prepare_invoices(). The invoices are created, then the taxes
+        are computed, the amounts are checked and the invoices are
+        validated for the whole chunk at once. If messages is a dict, the
+        notes are added to it instead of being posted (see post_note()).
+        Returns a list of (invoice, invoice_desc, res_iinfo)"""
+        aio = self.env['account.invoice']
+        if messages is not None:
+            # no tracking, followers or creation message: the notes of
+            # the invoices are written later as a single message
+            aio = aio.with_context(
+                tracking_disable=True, mail_notrack=True,
+                mail_create_nolog=True, mail_create_nosubscribe=True)
+        if stats is None:
+            stats = SyncStats()
+        invoices = aio.browse(False)
+        with stats.timer('create'):
+            for invoice_desc, res_iinfo, vals in chunk:
+                invoices += aio.create(vals)
+        with stats.timer('tax'):
+            invoices.button_reset_taxes()
+        amounts = dict([
+            (inv['id'], inv)
+            for inv in invoices.read(['amount_untaxed', 'amount_total'])])
+        prec = self.env['decimal.precision'].precision_get('Account')
+        res = []
+        for invoice, (invoice_desc, res_iinfo, vals) in zip(invoices, chunk):
+            amount_untaxed = amounts[invoice.id]['amount_untaxed']
+            amount_total = amounts[invoice.id]['amount_total']
+            logger.debug(
+                'res_iinfo.finalprice=%s ; invoice.amount_total=%s',
+                res_iinfo.finalprice, amount_total)
+            if float_compare(
+                    float(res_iinfo.baseprice),
+                    amount_untaxed,
+                    precision_digits=prec):
+                raise Warning(_(
+                    "For OVH invoice '%s' dated %s related to "
+                    "account '%s', "
+                    "the total untaxed amount is %.2f "
+                    "whereas the total untaxed amount in Odoo is %.2f.")
+                    % (invoice_desc['number'], invoice_desc['date'],
+                        invoice_desc['account'].login, res_iinfo.baseprice,
+                        amount_untaxed))
+
+            if float_compare(
+                    float(res_iinfo.finalprice),
+                    amount_total,
+                    precision_digits=prec):
+                # we should force the VAT amount
+                assert invoice.tax_line, 'Invoice has no tax line'
+                native_vat_amount = invoice.tax_line[0].amount
+                invoice.tax_line[0].amount = float(res_iinfo.tax)
+                self.post_note(
+                    invoice,
+                    'The total tax amount has been forced to %.2f %s '
+                    '(initial amount: %.2f).'
+                    % (float(res_iinfo.tax), invoice.currency_id.symbol,
+                        native_vat_amount), messages=messages)
+            self.post_note(invoice, _(
+                '<p>This OVH invoice has been downloaded automatically '
+                'via the %s with OVH account %s.</p>'
+                '<ul>'
+                '<li>Total without taxes: %s</li>'
+                '<li>Total VAT: %s</li>'
+                '<li>Total with taxes: %s</li>'
+                '</ul>')
+                % (API_NAMES[invoice_desc['account'].api_type],
+                    invoice_desc['account'].login, res_iinfo.baseprice,
+                    res_iinfo.tax, res_iinfo.finalprice), messages=messages)
+            if invoice_desc['account'].attach_detail_csv:
+                name = 'OVH_invoice_%s_detail.csv' % invoice_desc['number']
+                self.env['ir.attachment'].create({
+                    'name': name,
+                    'datas_fname': name,
+                    'datas': base64.encodestring(
+                        self._prepare_detail_csv(res_iinfo)),
+                    'res_id': invoice.id,
+                    'res_model': 'account.invoice',
+                    })
+            res.append((invoice, invoice_desc, res_iinfo))
+        # Validate invoices
+        if options['auto_validate']:
+            with stats.timer('validate'):
+                invoices.signal_workflow('invoice_open')
+            stats.incr('validated', len(invoices))
+        return res
+
+    @api.model
+    def create_invoices_safe(
+            self, chunk, options, failures, stats=None, messages=None):
+        """Same as create_invoices() but inside a savepoint. If the chunk
+        fails, its invoices are created one by one, each one in its own
+        savepoint. The invoices that cannot be created are added to
+        failures as (invoice_desc, error_message)"""
+        if not chunk:
+            return []
+        try:
+            # the notes of a rolled back chunk must not be kept
+            chunk_messages = None
+            if messages is not None:
+                chunk_messages = {}
+            with self._cr.savepoint():
+                res = self.create_invoices(
+                    chunk, options, stats=stats, messages=chunk_messages)
+            if messages is not None:
+                for invoice_id, notes in chunk_messages.items():
+                    messages.setdefault(invoice_id, []).extend(notes)
+            return res
+        except Exception, e:
+            self.env.invalidate_all()
+            if len(chunk) == 1:
+                invoice_desc = chunk[0][0]
+                logger.warning(
+                    'Failed to create the OVH invoice %s dated %s related '
+                    'to account %s: %s', invoice_desc['number'],
+                    invoice_desc['date'], invoice_desc['account'].login, e)
+                failures.append((invoice_desc, exception_message(e)))
+                return []
+        res = []
+        for item in chunk:
+            res += self.create_invoices_safe(
+                [item], options, failures, stats=stats, messages=messages)
+        return res
+
+    @api.multi
+    def get_import_options(self):
+        self.ensure_one()
+        return {
+            'from_date': self.from_date,
+            'full_resync': self.full_resync,
+            'attach_pdf': self.attach_pdf,
+            'defer_pdf': self.defer_pdf,
+            'auto_validate': self.auto_validate,
+            'commit_every': self.commit_every,
+            }
+
+    @api.model
+    def iter_listed_bills(self, ovh_account, bills, options, stats, mark):
+        """Generator that yields the invoice_desc of the OVH invoices of
+        the list bills [(number, date, total, total with VAT)] that must
+        be imported. The skipped invoices are counted in stats and the
+        listed invoices are added to mark (LastImportMark)"""
+        for index, (oinv_num, oinv_date, total, total_vat) in enumerate(
+                bills):
+            if (
+                    not options['full_resync'] and
+                    not ovh_account.is_bill_after_last_import(
+                        oinv_date, oinv_num)):
+                stats.incr('skipped_mark')
+                continue
+            invoice_desc = {
+                'number': oinv_num,
+                'date': oinv_date,
+                'account': ovh_account,  # object
+                'index': index,  # position in the list, for the progress
+                }
+            if options['from_date']:
+                if oinv_date < options['from_date']:
                     logger.info(
-                        'Skipping OVH invoice %s dated %s related to '
-                        'account %s because it is a '
-                        'special pre-paid invoice',
+                        "Skipping OVH invoice %s dated %s related to "
+                        " account %s because too old",
                         invoice_desc['number'], invoice_desc['date'],
                         invoice_desc['account'].login)
+                    stats.incr('skipped_old')
                     continue
-                # Check if this invoice is not already in the system
-                existing_inv = aio.search([
-                    ('type', '=', 'in_invoice'),
-                    ('partner_id', '=', ovh_partner.id),
-                    ('supplier_invoice_number', '=', oinv_num),
-                    ])
-                if existing_inv:
+            logger.info(
+                "billingInvoiceList: OVH invoice number %s dated %s "
+                "related to account %s",
+                invoice_desc['number'], invoice_desc['date'],
+                invoice_desc['account'].login)
+            if not total and not total_vat:
+                logger.info(
+                    'Skipping OVH invoice %s dated %s related to '
+                    'account %s because the amount is 0',
+                    invoice_desc['number'], invoice_desc['date'],
+                    invoice_desc['account'].login)
+                stats.incr('skipped_zero')
+                continue
+            if oinv_num and oinv_num.startswith('PP_'):
+                logger.info(
+                    'Skipping OVH invoice %s dated %s related to '
+                    'account %s because it is a '
+                    'special pre-paid invoice',
+                    invoice_desc['number'], invoice_desc['date'],
+                    invoice_desc['account'].login)
+                stats.incr('skipped_prepaid')
+                continue
+            mark.add_bill(oinv_date, oinv_num)
+            yield invoice_desc
+
+    @api.model
+    def iter_new_bills(
+            self, ovh_account, ovh_partner, invoice_descs, chunk_size,
+            stats):
+        """Generator that yields (invoice_desc, cached_bill) for the
+        invoice_descs that are not already in Odoo. The invoice_descs are
+        checked by chunks, with a single query per chunk for the existing
+        invoices and another one for the details in the local cache
+        (cached_bill is None if the details are not in the cache)"""
+        oiio = self.env['ovh.invoice.info'].sudo()
+        for chunk in split_every(chunk_size, invoice_descs):
+            existing_numbers = self.get_existing_invoice_numbers(
+                ovh_partner, [desc['number'] for desc in chunk])
+            todo = []
+            for invoice_desc in chunk:
+                if invoice_desc['number'] in existing_numbers:
                     logger.warning(
                         'The OVH invoice number %s dated %s already '
                         'exists in Odoo',
                         invoice_desc['number'], invoice_desc['date'])
+                    stats.incr('skipped_duplicate')
                     continue
+                todo.append(invoice_desc)
+            cached_bills = oiio.get_bills(
+                ovh_account.login, [desc['number'] for desc in todo],
+                api_type=ovh_account.api_type)
+            for invoice_desc in todo:
+                cached_bill = cached_bills.get(invoice_desc['number'])
+                invoice_desc['cached'] = bool(cached_bill)
+                yield (invoice_desc, cached_bill)
+
+    @api.model
+    def get_soap_bill_source(
+            self, soap, ovh_account, password, country_code, stats):
+        session = get_soap_session(
+            ovh_account.login, password, country_code,
+            self.get_int_param(
+                'ovh_supplier_invoice.soapi_session_ttl',
+                SOAPI_SESSION_TTL) * 60)
+        try:
+            with stats.timer('login'):
+                session.get(soap)
+        except Exception, e:
+            raise Warning(_(
+                "Cannot connect to the OVH SoAPI with login '%s'. "
+                "The error message is '%s'.")
+                % (ovh_account.login, unicode(e)))
+        logger.info(
+            'Starting OVH soAPI query billingInvoiceList (account %s)',
+            ovh_account.login)
+        with stats.timer('list'):
+            res_ilist = session.call(soap, 'billingInvoiceList')
+        logger.debug('result billingInvoiceList=%s', res_ilist)
+        # Only keep the fields that we use, so that the SOAP objects
+        # of the list can be freed
+        bills = [
+            (oinv.billnum, oinv.date[:10], oinv.totalPrice,
+                oinv.totalPriceWithVat)
+            for oinv in res_ilist.item]
+        del res_ilist
+
+        def fetch_bill(invoice_desc):
+            # Executed in a worker thread: must not use the ORM
+            logger.info(
+                'Starting OVH soAPI query billingInvoiceInfo on OVH '
+                'invoice number %s dated %s',
+                invoice_desc['number'], invoice_desc['date'])
+            return OvhBill.from_soap(session.call(
+                soap, 'billingInvoiceInfo', invoice_desc['number'],
+                password, country_code))
+        return bills, fetch_bill
+
+    @api.model
+    def get_rest_bill_source(
+            self, ovh_account, ovh_partner, options, stats, failures):
+        client = get_rest_client(
+            ovh_account.application_key, ovh_account.application_secret,
+            ovh_account.consumer_key, ovh_account.rest_endpoint,
+            self.get_int_param(
+                'ovh_supplier_invoice.soapi_workers', SOAPI_WORKERS))
+        # The REST API filters the bills by date, so the bills before
+        # the last import are not even listed
+        date_from = options['from_date'] or False
+        if not options['full_resync'] and ovh_account.last_bill_date:
+            date_from = max(date_from, ovh_account.last_bill_date)
+        logger.info(
+            'Starting OVH REST query /me/bill from %s (account %s)',
+            date_from, ovh_account.login)
+        chunk_size = self.get_int_param(
+            'ovh_supplier_invoice.create_chunk_size', CREATE_CHUNK_SIZE)
+        with stats.timer('list'):
+            try:
+                bill_ids = client.list_bill_ids(date_from=date_from)
+            except Exception, e:
+                raise Warning(_(
+                    "Cannot list the bills of the OVH account '%s' with "
+                    "the REST API. The error message is '%s'.")
+                    % (ovh_account.login, unicode(e)))
+            # The REST API only lists the IDs of the bills, so the bills
+            # that are already in Odoo are not queried
+            new_ids = []
+            for chunk in split_every(chunk_size, bill_ids):
+                existing_numbers = self.get_existing_invoice_numbers(
+                    ovh_partner, chunk)
+                new_ids += [
+                    bill_id for bill_id in chunk
+                    if bill_id not in existing_numbers]
+            headers = client.get_bill_headers(new_ids)
+        # the bills of new_ids are counted as listed by import_ovh_account()
+        stats.incr('listed', len(bill_ids) - len(new_ids))
+        stats.incr('skipped_duplicate', len(bill_ids) - len(new_ids))
+        for bill_id, header, e in headers:
+            if e is not None:
+                # the date of the bill is unknown, so the mark of the last
+                # import must not move after the first listed date
+                failures.append(
+                    ({'number': bill_id, 'date': date_from or ''},
+                        exception_message(e)))
+        headers = [header for bill_id, header, e in headers if header]
+        headers.sort(key=lambda header: (header['date'], header['billId']))
+        bills = [
+            (header['billId'], header['date'][:10],
+                header['priceWithoutTax']['value'],
+                header['priceWithTax']['value'])
+            for header in headers]
+        headers = dict([(header['billId'], header) for header in headers])
+
+        def fetch_bill(invoice_desc):
+            # Executed in a worker thread: must not use the ORM
+            logger.info(
+                'Starting OVH REST query /me/bill/%s/details dated %s',
+                invoice_desc['number'], invoice_desc['date'])
+            return client.get_bill(
+                invoice_desc['number'],
+                header=headers.pop(invoice_desc['number'], None))
+        return bills, fetch_bill
+
+    @api.model
+    def get_bill_source(
+            self, soap, ovh_account, password, country_code, ovh_partner,
+            options, stats, failures=None):
+        """Lists the OVH invoices of the account with its API.
+        Returns (bills, fetch_bill) where bills is the list of
+        (number, date, total, total with VAT) of the OVH invoices and
+        fetch_bill(invoice_desc) returns the OvhBill of an OVH invoice.
+        The OVH invoices that could be listed but not queried are added to
+        failures as (invoice_desc, error_message)"""
+        if failures is None:
+            failures = []
+        if ovh_account.api_type == 'rest':
+            return self.get_rest_bill_source(
+                ovh_account, ovh_partner, options, stats, failures)
+        return self.get_soap_bill_source(
+            soap or self.get_soap_proxy(), ovh_account, password,
+            country_code, stats)
+
+    @api.model
+    def import_ovh_account(
+            self, soap, ovh_account, password, country_code,
+            ovh_partner, products, options):
+        """Import the new invoices of an OVH account.
+        The OVH invoices go through a pipeline of generators (filter,
+        check of the existing invoices, details, creation by chunks) with
+        bounded buffers, so that the memory doesn't depend on the number
+        of invoices of the account.
+        The counters and timings are added to options['stats'].
+        When options['deadline'] (a time.time() value) is reached, the
+        import stops after the current chunk and sets
+        options['interrupted']: the next import skips the invoices
+        already created.
+        Returns (number of created invoices, list of error messages)"""
+        stats = options.get('stats') or SyncStats()
+        self = self.with_account_company(ovh_account)
+        ovh_account = ovh_account.with_env(self.env)
+        ovh_partner = ovh_partner.with_env(self.env)
+        self.configure_rate_limiter()
+        # cache of the tax and onchange results for this import
+        cache = {}
+        self.report_progress(options, 'list')
+        # invoices that could not be queried, see ovh_invoice_info_iter()
+        fetch_failures = []
+        bills, fetch_bill = self.get_bill_source(
+            soap, ovh_account, password, country_code, ovh_partner, options,
+            stats, failures=fetch_failures)
+        stats.incr('listed', len(bills) + len(fetch_failures))
+
+        chunk_size = self.get_int_param(
+            'ovh_supplier_invoice.create_chunk_size', CREATE_CHUNK_SIZE)
+        mark = LastImportMark()
+        failures = []
+        created = 0
+        uncommitted = 0
+        self.report_progress(options, 'import', todo=len(bills), done=0)
+        oiio = self.env['ovh.invoice.info'].sudo()
+        invoice_descs = self.iter_listed_bills(
+            ovh_account, bills, options, stats, mark)
+        items = self.iter_new_bills(
+            ovh_account, ovh_partner, invoice_descs, chunk_size, stats)
+        info_iter = self.ovh_invoice_info_iter(
+            fetch_bill, items, stats=stats, failures=fetch_failures)
+        for chunk in split_every(chunk_size, info_iter):
+            oiio.store_bills(ovh_account.login, [
+                (invoice_desc, res_iinfo) for invoice_desc, res_iinfo in chunk
+                if not invoice_desc['cached']],
+                api_type=ovh_account.api_type)
+            chunk_failures = list(fetch_failures)
+            del fetch_failures[:]
+            pdf_todo = []
+            messages = {}
+            prepared = self.prepare_invoices(
+                chunk, ovh_partner, products, options, chunk_failures,
+                cache=cache, stats=stats)
+            for invoice, invoice_desc, res_iinfo in self.create_invoices_safe(
+                    prepared, options, chunk_failures, stats=stats,
+                    messages=messages):
+                created += 1
+                stats.incr('created')
+                if options['attach_pdf'] and not options.get('defer_pdf'):
+                    invoice_desc['pdf_url'] = res_iinfo.get('pdf_url')
+                    pdf_todo.append(
+                        (invoice, invoice_desc, res_iinfo.password))
+            for invoice_desc, msg in chunk_failures:
+                mark.add_failure(invoice_desc['date'], invoice_desc['number'])
+            failures += chunk_failures
+            if pdf_todo:
+                self.report_progress(options, 'pdf')
+                self.ovh_invoices_attach_pdf(
+                    pdf_todo, stats=stats, messages=messages)
+            self.flush_notes(messages)
+            uncommitted += len(chunk)
+            self.report_progress(
+                options, 'import', done=chunk[-1][0]['index'] + 1)
+            if (
+                    options['commit_every'] and
+                    uncommitted >= options['commit_every']):
+                self._cr.commit()
+                uncommitted = 0
                 logger.info(
-                    'Starting OVH soAPI query billingInvoiceInfo on OVH '
-                    'invoice number %s dated %s',
-                    invoice_desc['number'], invoice_desc['date'])
-                res_iinfo = soap.billingInvoiceInfo(
-                    session, oinv_num, account.password, country_code)
-                logger.debug(
-                    'Result billingInvoiceInfo for invoice %s: %s',
-                    oinv_num, res_iinfo)
-                vals = self._prepare_invoice_vals(
-                    invoice_desc, ovh_partner, res_iinfo, products)
-                invoice = aio.create(vals)
-                invoice.button_reset_taxes()
-                logger.debug(
-                    'res_iinfo.finalprice=%s ; invoice.amount_total=%s',
-                    res_iinfo.finalprice, invoice.amount_total)
-                prec = self.env['decimal.precision'].precision_get('Account')
-                if float_compare(
-                        float(res_iinfo.baseprice),
-                        invoice.amount_untaxed,
-                        precision_digits=prec):
-                    raise Warning(_(
-                        "For OVH invoice '%s' dated %s related to "
-                        "account '%s', "
-                        "the total untaxed amount is %.2f "
-                        "whereas the total untaxed amount in Odoo is %.2f.")
-                        % (invoice_desc['number'], invoice_desc['date'],
-                            invoice_desc['account'].login, res_iinfo.baseprice,
-                            invoice.amount_untaxed))
-
-                if float_compare(
-                        float(res_iinfo.finalprice),
-                        invoice.amount_total,
-                        precision_digits=prec):
-                    # we should force the VAT amount
-                    assert invoice.tax_line, 'Invoice has no tax line'
-                    native_vat_amount = invoice.tax_line[0].amount
-                    invoice.tax_line[0].amount = float(res_iinfo.tax)
-                    invoice.message_post(
-                        'The total tax amount has been forced to %.2f %s '
-                        '(initial amount: %.2f).'
-                        % (float(res_iinfo.tax), invoice.currency_id.symbol,
-                            native_vat_amount))
-                invoices += invoice
-                invoice.message_post(_(
-                    '<p>This OVH invoice has been downloaded automatically '
-                    'via the SoAPI with OVH account %s.</p>'
-                    '<ul>'
-                    '<li>Total without taxes: %s</li>'
-                    '<li>Total VAT: %s</li>'
-                    '<li>Total with taxes: %s</li>'
-                    '</ul>')
-                    % (ovh_account.login, res_iinfo.baseprice, res_iinfo.tax,
-                        res_iinfo.finalprice))
-                # Attach PDF
-                if self.attach_pdf:
-                    self.ovh_invoice_attach_pdf(
-                        invoice, invoice_desc, res_iinfo.password)
-                # Validate invoice
-                if self.auto_validate:
-                    workflow.trg_validate(
-                        self._uid, aio._name, invoice.id,
-                        'invoice_open', self._cr)
-
-        # delete the wizard entry, to avoid leaving passwords in DB
-        # in table ovh_invoice_get_account
+                    'Commit after %d invoices of OVH account %s',
+                    created, ovh_account.login)
+            # the records of the chunk are not needed any more, so the
+            # cache must not grow with the number of invoices
+            self.env.invalidate_all()
+            if options.get('deadline') and time.time() > options['deadline']:
+                self._cr.commit()
+                options['interrupted'] = True
+                logger.info(
+                    'Import of OVH account %s interrupted after %d invoices '
+                    'to be resumed later', ovh_account.login, created)
+                break
+        # stops the worker threads of an interrupted import
+        info_iter.close()
+
+        for invoice_desc, msg in fetch_failures:
+            mark.add_failure(invoice_desc['date'], invoice_desc['number'])
+        failures += fetch_failures
+        if not options.get('interrupted'):
+            self.report_progress(options, 'import', done=len(bills))
+        stats.incr('failed', len(failures))
+        # the invoices after the last chunk have not been imported yet
+        if mark.last_bill and not options.get('interrupted'):
+            ovh_account.update_last_import(*mark.last_bill)
+        errors = [
+            _("OVH invoice %s dated %s (account %s): %s") % (
+                desc['number'], desc['date'], ovh_account.login, msg)
+            for desc, msg in failures]
+        return created, errors
+
+    @api.model
+    def import_ovh_account_thread(
+            self, soap, ovh_account_id, password, country_code,
+            ovh_partner_id, options):
+        """Executed in a worker thread, with its own cursor: the invoices
+        of the OVH account are committed independently of the other
+        accounts.
+        Returns (number of created invoices, list of error messages, stats,
+        duration)"""
+        start = time.time()
+        stats = SyncStats()
+        options = dict(options, stats=stats)
+        with api.Environment.manage():
+            registry = openerp.registry(self._cr.dbname)
+            with registry.cursor() as cr:
+                env = api.Environment(cr, self._uid, self._context)
+                wizard = env[self._name]
+                ovh_account = env['ovh.account'].browse(ovh_account_id)
+                login = ovh_account.login
+                try:
+                    created, errors = wizard.import_ovh_account(
+                        soap, ovh_account, password, country_code,
+                        env['res.partner'].browse(ovh_partner_id),
+                        wizard.get_ovh_products(), options)
+                except Exception, e:
+                    cr.rollback()
+                    logger.exception(
+                        'Failed to import the invoices of OVH account %s',
+                        login)
+                    return (0, [_('OVH account %s: %s') % (
+                        login, exception_message(e))],
+                        stats, time.time() - start)
+                return (created, errors, stats, time.time() - start)
+
+    @api.model
+    def validate_invoices_new_cursor(
+            self, sync_run_id, ovh_account_id, stats=None):
+        # The invoices created by the worker threads are not visible
+        # in the transaction of the wizard
+        if stats is None:
+            stats = SyncStats()
+        registry = openerp.registry(self._cr.dbname)
+        with stats.timer('validate'):
+            with registry.cursor() as cr:
+                env = api.Environment(cr, self._uid, self._context)
+                wizard = env[self._name].with_account_company(
+                    env['ovh.account'].browse(ovh_account_id))
+                invoices = wizard.env['account.invoice'].search([
+                    ('ovh_sync_run_id', '=', sync_run_id),
+                    ('ovh_account_id', '=', ovh_account_id),
+                    ('state', '=', 'draft'),
+                    ])
+                invoices.signal_workflow('invoice_open')
+        stats.incr('validated', len(invoices))
+
+    @api.model
+    def with_account_company(self, ovh_account):
+        """Returns the wizard with the company of the OVH account in the
+        context, as the default values of the invoices (journal, currency,
+        period...) depend on it. The multi-company rules of the invoices
+        and journals only accept the current company of the user and its
+        child companies, so the imports of the other allowed companies of
+        the user are run as superuser."""
+        user = self.env.user
+        company = ovh_account.sudo().company_id
+        # the superuser runs the scheduled imports of the accounts that
+        # have no scheduled import user
+        if self._uid != SUPERUSER_ID and company not in user.company_ids:
+            raise Warning(_(
+                "You are not allowed to import the invoices of the OVH "
+                "account '%s' of the company %s.")
+                % (ovh_account.sudo().login, company.name))
+        wizard = self.with_context(
+            company_id=company.id, force_company=company.id,
+            # user of the invoices created as superuser
+            ovh_import_uid=self._context.get('ovh_import_uid', self._uid))
+        child_company_ids = self.env['res.company'].sudo().search(
+            [('id', 'child_of', user.company_id.id)]).ids
+        if company.id not in child_company_ids:
+            wizard = wizard.sudo()
+        return wizard
+
+    @api.model
+    def get_import_user(self):
+        """Returns the user who runs the import, also when the import is
+        run as superuser (see with_account_company())"""
+        return self.env['res.users'].browse(
+            self._context.get('ovh_import_uid', self._uid))
+
+    @api.model
+    def get_country_code(self, company=None):
+        if company is None:
+            company = self.env.user.company_id
+        # the company may not be readable by the user (see
+        # with_account_company())
+        company = company.sudo()
+        if not company.country_id:
+            raise Warning(
+                _('Missing country on company %s') % company.name)
+        return company.country_id.code.lower()
+
+    @api.model
+    def get_ovh_partner(self):
+        partner_id = self.pool['res.partner']._get_ovh_partner_id(
+            self._cr, self._uid)
+        if not partner_id:
+            raise Warning(
+                _("Couldn't find the supplier OVH. Make sure you have "
+                    "a supplier OVH with VAT number FR22424761419."))
+        return self.env['res.partner'].browse(partner_id)
+
+    @api.multi
+    def enqueue_jobs(self):
+        self.ensure_one()
+        # the password of the jobs can't be written by the accountants
+        jobs = self.env['ovh.invoice.import.job'].sudo()
+        options = self.get_import_options()
+        for account in self.account_ids:
+            jobs += jobs.create({
+                'ovh_account_id': account.ovh_account_id.id,
+                'user_id': self._uid,
+                'password': account.password,
+                'from_date': options['from_date'],
+                'full_resync': options['full_resync'],
+                'attach_pdf': options['attach_pdf'],
+                'defer_pdf': options['defer_pdf'],
+                'auto_validate': options['auto_validate'],
+                })
         self.unlink()
         action = self.env['ir.actions.act_window'].for_xml_id(
-            'account', 'action_invoice_tree2')
-        action.update({
-            'view_mode': 'tree,form,calendar,graph',
-            'domain': "[('id', 'in', %s)]" % invoices.ids,
-            'views': False,
-            'nodestroy': False,
-            })
+            'ovh_supplier_invoice', 'ovh_invoice_import_job_action')
+        action['domain'] = "[('id', 'in', %s)]" % jobs.ids
         return action
 
+    @api.multi
+    def get(self):
+        self.ensure_one()
+        if self.background:
+            return self.enqueue_jobs()
+        soap = None
+        if 'soapi' in self.account_ids.mapped('ovh_account_id.api_type'):
+            soap = self.get_soap_proxy()
+        # the OVH accounts can belong to several companies
+        country_codes = {}
+        for company in self.account_ids.mapped('ovh_account_id.company_id'):
+            country_codes[company] = self.get_country_code(company)
+        ovh_partner = self.get_ovh_partner()
+        options = self.get_import_options()
+
+        errors = []
+        parallel = self.parallel_accounts and len(self.account_ids) > 1
+        run = self.env['ovh.sync.run'].create({
+            'mode': parallel and 'parallel' or 'wizard',
+            })
+        options['sync_run_id'] = run.id
+        if parallel:
+            # The invoices created by the worker threads are linked to
+            # the run, so it must be visible in their transactions
+            self._cr.commit()
+            accounts = [
+                (account.ovh_account_id.id, account.password,
+                    country_codes[account.ovh_account_id.company_id])
+                for account in self.account_ids]
+            # Sequences of validated invoices would be locked by
+            # concurrent transactions, so validation is done at the end
+            thread_options = dict(options, auto_validate=False)
+            workers = min(
+                self.get_int_param(
+                    'ovh_supplier_invoice.account_workers', ACCOUNT_WORKERS),
+                len(accounts))
+            pool = ThreadPool(workers)
+            try:
+                results = pool.map(
+                    lambda account: self.import_ovh_account_thread(
+                        soap, account[0], account[1], account[2],
+                        ovh_partner.id, thread_options),
+                    accounts)
+            finally:
+                pool.close()
+                pool.join()
+            for account, result in zip(self.account_ids, results):
+                created, account_errors, stats, duration = result
+                if options['auto_validate'] and created:
+                    start = time.time()
+                    # the invoices are already committed: a failed
+                    # validation only leaves them in draft
+                    try:
+                        self.validate_invoices_new_cursor(
+                            run.id, account.ovh_account_id.id, stats=stats)
+                    except Exception, e:
+                        logger.exception(
+                            'Failed to validate the invoices of OVH '
+                            'account %s', account.ovh_account_id.login)
+                        account_errors = account_errors + [_(
+                            'OVH account %s: the invoices could not be '
+                            'validated: %s') % (
+                            account.ovh_account_id.login,
+                            exception_message(e))]
+                    duration += time.time() - start
+                run.add_account_stats(
+                    account.ovh_account_id, stats, duration,
+                    error='\n'.join(account_errors))
+                errors += account_errors
+        else:
+            products = self.get_ovh_products()
+            if options['commit_every']:
+                # a failed account is rolled back to the last commit
+                self._cr.commit()
+            for account in self.account_ids:
+                ovh_account = account.ovh_account_id
+                start = time.time()
+                stats = SyncStats()
+                account_errors = []
+                try:
+                    with account_savepoint(
+                            self._cr, options['commit_every']):
+                        account_errors = self.import_ovh_account(
+                            soap, ovh_account, account.password,
+                            country_codes[ovh_account.company_id],
+                            ovh_partner, products,
+                            dict(options, stats=stats))[1]
+                except Exception, e:
+                    self.env.invalidate_all()
+                    logger.exception(
+                        'Failed to import the invoices of OVH account %s',
+                        ovh_account.login)
+                    account_errors = [_('OVH account %s: %s') % (
+                        ovh_account.login, exception_message(e))]
+                run.add_account_stats(
+                    ovh_account, stats, time.time() - start,
+                    error='\n'.join(account_errors))
+                if options['commit_every']:
+                    self._cr.commit()
+                errors += account_errors
+        run.close()
+
+        # delete the wizard lines, to avoid leaving passwords in DB
+        # in table ovh_invoice_get_account
+        self.account_ids.unlink()
+        if errors:
+            self.write({
+                'state': 'done',
+                'report': '\n'.join(errors),
+                'sync_run_id': run.id,
+                })
+            return {
+                'type': 'ir.actions.act_window',
+                'res_model': self._name,
+                'res_id': self.id,
+                'view_mode': 'form',
+                'target': 'new',
+                }
+        self.unlink()
+        return run.invoices_action()
+
+    @api.multi
+    def show_invoices(self):
+        self.ensure_one()
+        run = self.sync_run_id
+        self.unlink()
+        return run.invoices_action()
+
 
 class OvhInvoiceGetAccount(models.TransientModel):
     _name = 'ovh.invoice.get.account'
@@ -444,4 +1803,8 @@ class OvhInvoiceGetAccount(models.TransientModel):
         'ovh.invoice.get', string='Wizard', ondelete='cascade')
     ovh_account_id = fields.Many2one(
         'ovh.account', string='OVH Account', required=True)
+    api_type = fields.Selection(
+        related='ovh_account_id.api_type', readonly=True)
+    company_id = fields.Many2one(
+        related='ovh_account_id.company_id', readonly=True)
     password = fields.Char(string='OVH Password')